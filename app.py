@@ -1,23 +1,52 @@
 import falcon
 import json
 import os
-import shutil
-import subprocess
-import sys
 import traceback
 from datetime import datetime, timedelta
-from sqlalchemy import func, desc
 from sqlalchemy.exc import SQLAlchemyError
 
 import model
 import endpoint
 import util
+import db
 from db import engine, session
 from util import UserInfo
 
-# Cache of the current year.
-c_year = None
-c_year_update = None
+
+class DBSession(object):
+    """
+    db.session is a scoped_session, each request (thread) works with its own
+    session. The session is removed (closed, uncommitted changes rolled
+    back) at the end of every request, including failed ones.
+    Must be the first middleware, so its process_response runs last.
+
+    If SQL_ALCHEMY_REPLICA_URI is configured, GET requests are served from
+    the replica, except:
+     * resources with attribute `db_primary = True` (writes in GET,
+       read-your-writes paths),
+     * requests with query parameter `primary` (e.g. ?primary=1).
+    Middlewares before the resource (Authorizer, Year_fill) always use the
+    primary.
+
+    Also counts SQL queries of the request (util.querystats), see Logger.
+    """
+
+    def process_request(self, req, resp):
+        req.context['query_stats'] = util.querystats.start()
+
+    def process_resource(self, req, resp, resource, params):
+        if (req.method == 'GET' and resource is not None and
+                not getattr(resource, 'db_primary', False) and
+                req.get_param('primary') is None):
+            db.use_replica()
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        try:
+            if not req_succeeded:
+                session.rollback()
+        finally:
+            session.remove()
+            util.querystats.stop()
 
 
 class JSONTranslator(object):
@@ -29,11 +58,9 @@ class JSONTranslator(object):
         if 'result' not in req.context:
             return
 
-        resp.body = json.dumps(
+        resp.body = util.encode_json(
             req.context['result'],
-            sort_keys=True,
-            indent=4,
-            ensure_ascii=False,
+            pretty=util.serialization.pretty_requested(req)
         )
 
 
@@ -43,7 +70,7 @@ class Authorizer(object):
         if req.auth:
             token_str = req.auth.split(' ')[-1]
             try:
-                token = session.query(model.Token).get(token_str)
+                token = util.auth.tokens.lookup(token_str)
 
                 if token is not None:
                     if (req.relative_uri != '/auth' and
@@ -52,14 +79,12 @@ class Authorizer(object):
                         req.context['user'] = UserInfo()
                         return
 
-                    try:
-                        req.context['user'] = UserInfo(
-                            session.query(model.User).get(token.user),
-                            token_str
-                        )
-                        return
-                    except AttributeError:
-                        pass
+                    req.context['user'] = UserInfo(
+                        token=token_str,
+                        user_id=token.user_id,
+                        role=token.role
+                    )
+                    return
             except:
                 session.rollback()
 
@@ -78,37 +103,66 @@ class SourceAddressFill:
 
 class Year_fill(object):
 
-    # This middleware has 2 purposes:
-    #  1) Get current year.
-    #  2) Test connection with db. (this is very important!)
+    # Get current year from the per-worker registry (util.year.years).
+    # Connection to db is tested by pool_pre_ping (db.py).
     def process_request(self, req, resp):
         if req.method == 'OPTIONS':
             return
         try:
             if ('YEAR' in req.headers):
                 req.context['year'] = req.headers['YEAR']
-                req.context['year_obj'] = session.query(model.Year).\
-                                          get(req.context['year'])
+                req.context['year_obj'] = util.year.years.get(
+                    req.context['year'])
             else:
-                year_obj = session.query(model.Year).\
-                           order_by(desc(model.Year.id)).first()
+                year_obj = util.year.years.current()
                 req.context['year_obj'] = year_obj
                 req.context['year'] = year_obj.id
         except SQLAlchemyError:
             session.rollback()
-            try:
-                if ('YEAR' in req.headers):
-                    req.context['year'] = req.headers['YEAR']
-                    req.context['year_obj'] = session.query(model.Year).\
-                                              get(req.context['year'])
-                else:
-                    year_obj = session.query(model.Year).\
-                               order_by(desc(model.Year.id)).first()
-                    req.context['year_obj'] = year_obj
-                    req.context['year'] = year_obj.id
-            except:
-                session.rollback()
-                raise
+            raise
+
+
+class GzipCompression(object):
+    """
+    Gzip komprese odpovedi pro klienty s 'Accept-Encoding: gzip'.
+    Komprimuji se odpovedi s telem od util.compression.MIN_SIZE bajtu.
+    Staticke soubory oznacene endpointem (resp.context['static_file'], viz
+    endpoint/content.py:TaskContent) se posilaji z cache predkomprimovanych
+    variant (util.compression.precompressed).
+    Musi byt v seznamu middlewaru pred JSONTranslator, aby jeho
+    process_response bezel az po serializaci.
+    """
+
+    def process_response(self, req, resp, *_):
+        content_type = resp.content_type or resp.options.default_media_type
+        if (req.method == 'HEAD' or resp.get_header('Content-Encoding') or
+                not util.compression.compressible(content_type)):
+            return
+
+        resp.append_header('Vary', 'Accept-Encoding')
+        if not util.compression.accepts_gzip(req.get_header('Accept-Encoding')):
+            return
+
+        if resp.stream is not None:
+            static_file = resp.context.get('static_file')
+            gz_path = (util.compression.precompressed(static_file)
+                       if static_file else None)
+            if gz_path is None:
+                return
+            resp.stream.close()
+            resp.set_stream(open(gz_path, 'rb'), os.path.getsize(gz_path))
+        else:
+            body = resp.render_body()
+            if body is None or len(body) < util.compression.MIN_SIZE:
+                return
+            resp.text = None
+            resp.data = util.compression.compress(body)
+
+        resp.set_header('Content-Encoding', 'gzip')
+        # Komprimovana varianta neni bajtove shodna s originalem
+        etag = resp.get_header('ETag')
+        if etag and not etag.startswith('W/'):
+            resp.set_header('ETag', 'W/' + etag)
 
 
 class AddCORS:
@@ -122,27 +176,60 @@ class AddCORS:
 
 
 def log(req, resp):
-    user = req.context.get("user")
-    user_id = user.id if user else '_'
-    ip = req.context['source_ip']
-
-    print(f'[{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}] '
-          f'[INFO] [HTTP] '
-          f'[{ip}] '
-          f'[{req.method}] '
-          f'[{resp.status.split()[0]}] '
-          f'[{user_id}] '
-          f'{req.relative_uri}')
-    sys.stdout.flush()
+    # Zapis probiha na pozadi, viz util/access_log.py
+    util.access_log.log(req, resp)
 
 
 class Logger(object):
     def process_request(self, req, resp):
         pass
-    def process_response(self, req, resp, *_):
+
+    def process_response(self, req, resp, resource, req_succeeded):
+        stats = req.context.get('query_stats')
+        if stats is not None:
+            user = req.context.get('user')
+            if user is not None and user.is_org():
+                resp.set_header('Server-Timing', stats.server_timing())
+
+            util.metrics.registry.observe_request(
+                req.uri_template or 'sink', req.method,
+                resp.status.split()[0], stats.elapsed)
+
+            if stats.over_threshold():
+                endpoint_name = (type(resource).__name__
+                                 if resource is not None else 'sink')
+                util.logger.get_log().warning(
+                    f"[SQL] {endpoint_name} {req.method} {req.uri_template}: "
+                    f"{stats.count} queries, {stats.db_time * 1000:.1f} ms in "
+                    f"database, slowest {stats.slowest_time * 1000:.1f} ms: "
+                    f"{stats.slowest_statement}"
+                )
+
         log(req, resp)
 
 
+class Profiler(object):
+    """
+    Runs the responder of selected requests under cProfile
+    (util/profiling.py). Must be the last middleware, so that the profile
+    covers just the responder.
+    """
+
+    def process_resource(self, req, resp, resource, params):
+        if resource is not None and util.profiling.requested(req):
+            req.context['profile'] = util.profiling.start()
+
+    def process_response(self, req, resp, *_):
+        profile = req.context.get('profile')
+        if profile is None:
+            return
+        stats = req.context.get('query_stats')
+        name = util.profiling.store(profile, req.method, req.uri_template,
+                                    stats.elapsed if stats else 0)
+        if name is not None:
+            resp.set_header('X-Profile', name)
+
+
 class RemoveTrailingSlashMiddleware:
     def process_request(self, req, resp):
         if req.path != '/' and req.path.endswith('/'):
@@ -160,7 +247,7 @@ class Corser(object):
 
     def process_response(self, request, response, *_):
         response.set_header('Access-Control-Allow-Headers',
-                            'authorization,content-type,year')
+                            'authorization,content-type,year,x-profile')
         response.set_header('Access-Control-Allow-Methods',
                             'OPTIONS,PUT,POST,GET,DELETE')
 
@@ -195,29 +282,18 @@ def error_handler(ex, req, resp, params):
 
 
 # Add Logger() to middleware for logging
-api = falcon.API(middleware=[SourceAddressFill(), RemoveTrailingSlashMiddleware(), JSONTranslator(), Authorizer(), Year_fill(),
-                 Corser(), AddCORS(), Logger()])
+api = falcon.API(middleware=[DBSession(), GzipCompression(), SourceAddressFill(), RemoveTrailingSlashMiddleware(), JSONTranslator(), Authorizer(), Year_fill(),
+                 Corser(), AddCORS(), Logger(), Profiler()])
 api.add_error_handler(Exception, handler=error_handler)
+util.querystats.install(db.engine, db.replica_engine)
+util.metrics.install_pool(db.engine, 'primary')
+util.metrics.install_pool(db.replica_engine, 'replica')
 api.req_options.auto_parse_form_urlencoded = True
 
 # Odkomentovat pro vytvoreni tabulek v databazi
 # model.Base.metadata.create_all(engine)
 
-# Create /tmp/box with proper permissions (for sandbox)
-if os.path.isdir(util.programming.EXEC_PATH):
-    shutil.rmtree(util.programming.EXEC_PATH, ignore_errors=True)
-
-try:
-    os.makedirs(util.programming.EXEC_PATH)
-except FileExistsError:
-    pass
-
-p = subprocess.Popen(["setfacl", "-d", "-m", "group:ksi:rwx",
-                      util.programming.EXEC_PATH])
-p.wait()
-if p.returncode != 0:
-    raise Exception("Cannot change umask to %s!" %
-                    (util.programming.EXEC_PATH))
+util.programming.prepare_exec_path()
 
 api.add_route('/robots.txt', endpoint.Robots())
 api.add_route('/csp', endpoint.CSP())
@@ -235,6 +311,7 @@ api.add_route('/modules/{id}', endpoint.Module())
 api.add_route('/modules/{id}/submit', endpoint.ModuleSubmit())
 api.add_route('/modules/{id}/submitFiles', endpoint.ModuleSubmit())  # alias required for swagger
 api.add_route('/submFiles/{id}', endpoint.ModuleSubmittedFile())
+api.add_route('/evaluations/{id}/status', endpoint.EvaluationStatus())
 api.add_route('/threads', endpoint.Threads())
 api.add_route('/threads/{id}', endpoint.Thread())
 api.add_route('/threadDetails/{id}', endpoint.ThreadDetails())
@@ -297,6 +374,9 @@ api.add_route('/admin/execs/{id}', endpoint.admin.Exec())
 api.add_route('/admin/monitoring-dashboard', endpoint.admin.MonitoringDashboard())
 api.add_route('/admin/diploma/{id}/grant', endpoint.admin.DiplomaGrant())
 api.add_route('/admin/instanceConfig', endpoint.admin.InstanceConfig())
+api.add_route('/admin/metrics', endpoint.admin.Metrics())
+api.add_route('/admin/profiles', endpoint.admin.Profiles())
+api.add_route('/admin/profiles/{name}', endpoint.admin.Profile())
 
 api.add_route('/unsubscribe/{id}', endpoint.Unsubscribe())
 
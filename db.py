@@ -1,11 +1,69 @@
+from contextlib import contextmanager
+from typing import Iterator
+
 import sqlalchemy
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 import config
 
 
-engine = sqlalchemy.create_engine(config.SQL_ALCHEMY_URI,
-                                  isolation_level="READ COMMITTED",
-                                  pool_recycle=3600)
+def _create_engine(uri: str) -> sqlalchemy.engine.Engine:
+    # Velikost poolu by mela odpovidat poctu vlaken gunicorn workeru
+    # (threads), kazde vlakno drzi behem pozadavku jedno spojeni.
+    return sqlalchemy.create_engine(
+        uri,
+        isolation_level="READ COMMITTED",
+        pool_recycle=3600,
+        pool_pre_ping=True,
+        pool_size=getattr(config, 'SQL_ALCHEMY_POOL_SIZE', 10),
+        max_overflow=getattr(config, 'SQL_ALCHEMY_MAX_OVERFLOW', 5),
+        pool_timeout=getattr(config, 'SQL_ALCHEMY_POOL_TIMEOUT', 30),
+    )
+
+
+engine = _create_engine(config.SQL_ALCHEMY_URI)
 _session = sessionmaker(bind=engine)
-session = _session()
+
+# Volitelna replika primarni databaze jen pro cteni (GET pozadavky),
+# viz app.py:DBSession.
+replica_engine = (
+    _create_engine(config.SQL_ALCHEMY_REPLICA_URI)
+    if getattr(config, 'SQL_ALCHEMY_REPLICA_URI', None) else None
+)
+_replica_session = (
+    sessionmaker(bind=replica_engine, info={'replica': True})
+    if replica_engine is not None else None
+)
+
+# Kazde vlakno ma vlastni session (scoped_session), na konci kazdeho
+# pozadavku ji uklidi middleware app.py:DBSession.
+session = scoped_session(_session)
+
+
+def use_replica() -> bool:
+    """Prepne session aktualniho vlakna na repliku (pokud je nastavena).
+    Volat na zacatku pozadavku, ktery jen cte."""
+    if _replica_session is None:
+        return False
+    session.remove()
+    session.registry.set(_replica_session())
+    return True
+
+
+@contextmanager
+def on_primary() -> Iterator[None]:
+    """Uvnitr bloku pouziva 'session' primarni databazi i v pozadavku
+    prepnutem na repliku. Pro nacitani dat do cache sdilenych mezi
+    pozadavky (replika muze byt pozadu za verzi cache)."""
+    current = session.registry()
+    if not current.info.get('replica'):
+        yield
+        return
+
+    primary = _session()
+    session.registry.set(primary)
+    try:
+        yield
+    finally:
+        primary.close()
+        session.registry.set(current)
@@ -21,3 +21,6 @@ from endpoint.admin.execs import Exec
 from endpoint.admin.monitoringDashboard import MonitoringDashboard
 from endpoint.admin.diploma import DiplomaGrant
 from endpoint.admin.instanceConfig import InstanceConfig
+from endpoint.admin.metrics import Metrics
+from endpoint.admin.profiles import Profiles
+from endpoint.admin.profiles import Profile
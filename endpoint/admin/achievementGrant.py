@@ -71,6 +71,7 @@ class AchievementGrant(object):
                     session.add(ua)
 
             session.commit()
+            util.cache.bump_scores_version(req.context['year'])
             if len(errors) > 0:
                 req.context['result'] = {'errors': errors}
             else:
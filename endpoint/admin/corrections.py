@@ -11,6 +11,8 @@ import util
 
 
 class Correction(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def on_get(self, req, resp, id):
         """
@@ -114,6 +116,8 @@ class Correction(object):
         )
         a_new = corr['achievements']
         if a_old != a_new:
+            util.cache.bump_scores_version(
+                util.task.year_of_task(corr['task_id']))
             # achievementy se nerovnaji -> proste smazeme vsechny dosavadni
             # a pridame do db ty, ktere nam prisly.
             for a_id in a_old:
@@ -164,6 +168,7 @@ class Correction(object):
             evaluation.cheat = data_eval['cheat'] \
                                if 'cheat' in data_eval else False
             session.commit()
+            util.best_score.update(evaluation.user, evaluation.module)
         except SQLAlchemyError:
             session.rollback()
             raise
@@ -205,6 +210,9 @@ class Corrections(object):
 
     """
 
+    # Viz app.py:DBSession
+    db_primary = True
+
     def on_get(self, req, resp):
         """
         Specifikace GET pozadavku:
@@ -388,50 +396,44 @@ class Corrections(object):
             corrections = []
             threads = []
             thr_details = []
+
+            # Radky si jednim pruchodem rozdelime podle (uloha, uzivatel),
+            # resp. podle vlakna, abychom je nemuseli filtrovat pro kazde
+            # opraveni zvlast.
+            evals_by_corr = util.grouping.group_by(
+                corrs_evals, lambda x: (x.Task.id, x.Evaluation.user))
+            modules_by_corr = util.grouping.group_by(
+                corrs_modules, lambda x: (x.Task.id, x.Evaluation.user))
+            achs_by_corr = util.grouping.group_by(
+                corrs_achs, lambda x: (x[0], x[1]), lambda x: x[2])
+            files_by_eval = util.grouping.group_by(
+                files, lambda smbfl: smbfl.evaluation)
+            root_posts_by_thread = util.grouping.group_by(
+                root_posts, lambda post_thr: post_thr[1].id,
+                lambda post_thr: post_thr[0].id)
+
             for corr in corrs_tasks:
-                evals = [
-                    x for x in corrs_evals
-                    if (x.Task.id == corr.Task.id and
-                        x.Evaluation.user == corr.Evaluation.user)
-                ]
+                corr_key = (corr.Task.id, corr.Evaluation.user)
+                evals = evals_by_corr.get(corr_key, [])
 
                 corrections.append(util.correction.to_json(
                     [
                         (evl, mod, None)
-                        for (evl, tsk, mod, thr, iscor) in [
-                            x for x in corrs_modules
-                            if (x.Task.id == corr.Task.id and
-                                x.Evaluation.user == corr.Evaluation.user)
-                        ]
+                        for (evl, tsk, mod, thr, iscor) in
+                        modules_by_corr.get(corr_key, [])
                     ],
                     [evl for (evl, tsk, mod, thr, iscor) in evals],
                     evals[0].Task.id,
                     corr.Thread.id if corr.Thread else None,
-                    [
-                        r
-                        for (a, b, r) in [
-                            task_id_user_id_a_id
-                            for task_id_user_id_a_id in corrs_achs
-                            if (task_id_user_id_a_id[0] == corr.Task.id and
-                                task_id_user_id_a_id[1] ==
-                                corr.Evaluation.user)
-                        ]
-                    ],
+                    achs_by_corr.get(corr_key, []),
                     (corr.is_corrected
                         if corr.is_corrected is not None else False),
-                    files
+                    files_by_eval
                 ))
 
                 if corr.Thread:
                     threads.append(util.thread.to_json(corr.Thread, user.id))
-                    r_posts = [
-                        pst.id
-                        for (pst, thrd) in [
-                            post_thr
-                            for post_thr in root_posts
-                            if post_thr[1].id == corr.Thread.id
-                        ]
-                    ]
+                    r_posts = root_posts_by_thread.get(corr.Thread.id, [])
 
                     thr_details.append(
                         util.thread.details_to_json(corr.Thread, r_posts)
@@ -439,14 +441,12 @@ class Corrections(object):
 
             # Ziskavame last_visit jednotlivych vlaken (opet na jeden SQL
             # pozadavek).
-            last_visit = util.thread.get_user_visit(user.id, year)
+            last_visit = util.grouping.index_by(
+                util.thread.get_user_visit(user.id, year),
+                lambda lv: lv.thread)
             posts = []
             for (post, thread) in db_posts:
-                lastv = None
-                for lv in last_visit:
-                    if lv.thread == post.thread:
-                        lastv = lv
-                        break
+                lastv = last_visit.get(post.thread)
                 posts.append(util.post.to_json(post, user.id, lastv, True))
 
             # A konecne vratime vysledek.
@@ -9,6 +9,8 @@ import util
 
 
 class CorrectionsEmail(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def _send_single_email(self, task, participant, notify, points, post,
                            commenter, solution_comment):
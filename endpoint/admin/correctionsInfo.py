@@ -8,6 +8,8 @@ import util
 
 
 class CorrectionInfo(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def on_get(self, req, resp, id):
         try:
@@ -34,6 +36,8 @@ class CorrectionInfo(object):
 
 
 class CorrectionsInfo(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def on_get(self, req, resp):
         """
@@ -8,6 +8,8 @@ import util
 
 
 class CorrectionsPublish(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def on_get(self, req, resp, id):
         """
@@ -34,6 +36,7 @@ class CorrectionsPublish(object):
                 return
             task.evaluation_public = public
             session.commit()
+            util.cache.bump_scores_version(util.task.year_of_task(task.id))
             req.context['result'] = {}
         except SQLAlchemyError:
             session.rollback()
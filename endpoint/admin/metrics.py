@@ -0,0 +1,35 @@
+import hmac
+
+import falcon
+
+import config
+import util
+
+
+class Metrics(object):
+    """
+    Metriky ve formatu Prometheus (util/metrics.py).
+    Pristup maji organizatori a scraper s tokenem METRICS_TOKEN z config.py
+    ('Authorization: Bearer <METRICS_TOKEN>').
+    """
+
+    def on_get(self, req, resp):
+        user = req.context['user']
+
+        if not (user.is_logged_in() and user.is_org()) and \
+                not self._scraper(req):
+            req.context['result'] = 'Nedostatecna opravneni'
+            resp.status = falcon.HTTP_400
+            return
+
+        resp.content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        resp.text = util.metrics.render()
+        resp.status = falcon.HTTP_200
+
+    @staticmethod
+    def _scraper(req) -> bool:
+        token = getattr(config, 'METRICS_TOKEN', None)
+        if not token or not req.auth:
+            return False
+        return hmac.compare_digest(req.auth.split(' ')[-1].encode(),
+                                   token.encode())
@@ -0,0 +1,54 @@
+import os
+
+import falcon
+
+import util
+
+
+class Profiles(object):
+    """ This endpoint lists stored request profiles (util/profiling.py). """
+
+    def on_get(self, req, resp):
+        user = req.context['user']
+
+        if (not user.is_logged_in()) or (not user.is_org()):
+            resp.status = falcon.HTTP_400
+            return
+
+        req.context['result'] = {
+            'profiles': util.profiling.list_profiles()
+        }
+
+
+class Profile(object):
+    """
+    This endpoint downloads a single profile in pstats format,
+    with ?format=text returns human readable summary
+    (?sort=cumulative|tottime|calls, ?limit=50).
+    """
+
+    def on_get(self, req, resp, name):
+        user = req.context['user']
+
+        if (not user.is_logged_in()) or (not user.is_org()):
+            resp.status = falcon.HTTP_400
+            return
+
+        path = util.profiling.profile_path(name)
+        if path is None:
+            resp.status = falcon.HTTP_404
+            return
+
+        if req.get_param('format') == 'text':
+            sort = req.get_param('sort') or 'cumulative'
+            if sort not in ('cumulative', 'tottime', 'calls'):
+                resp.status = falcon.HTTP_400
+                return
+            resp.content_type = falcon.MEDIA_TEXT
+            resp.text = util.profiling.render_text(
+                path, sort, req.get_param_as_int('limit') or 50)
+            return
+
+        resp.content_type = 'application/octet-stream'
+        resp.downloadable_as = name
+        resp.set_stream(open(path, 'rb'), os.path.getsize(path))
@@ -131,6 +131,12 @@ class Task(object):
             for _eval in evals:
                 session.delete(_eval)
 
+            session.query(model.BestScore).\
+                filter(model.BestScore.module.in_(
+                    session.query(model.Module.id).
+                    filter(model.Module.task == id)
+                )).delete(synchronize_session=False)
+
             session.query(model.Module).\
                 filter(model.Module.task == id).delete()
 
@@ -141,6 +147,9 @@ class Task(object):
 
             session.delete(task)
             session.commit()
+            util.cache.bump_scores_version(wave.year)
+            util.task.invalidate_max_points()
+            util.task.invalidate_deadlines()
 
             if thread is not None:
                 session.delete(thread)
@@ -288,6 +297,8 @@ class Tasks(object):
 
             session.add(task)
             session.commit()
+            util.task.invalidate_max_points()
+            util.task.invalidate_deadlines()
 
             req.context['result'] = {'atask': util.admin.task.admin_to_json(task)}
         except SQLAlchemyError:
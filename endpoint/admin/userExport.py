@@ -70,32 +70,29 @@ class UserExport(object):
             # a misto toho provest pouze jeden MEGA dotaz.
 
             # Skore uzivatele per modul (zahrnuje jen moduly evaluation_public)
+            # MAX(points) per (user, module) je predpocitan v best_scores.
             per_user = session.query(
-                model.Evaluation.user.label('user'),
-                func.max(model.Evaluation.points).label('points'),
-                func.max(model.Evaluation.cheat).label('cheat'),
+                model.BestScore.user.label('user'),
+                model.BestScore.points.label('points'),
+                model.BestScore.cheat.label('cheat'),
             ).\
                 join(model.Module,
-                     model.Evaluation.module == model.Module.id).\
+                     model.BestScore.module == model.Module.id).\
                 join(model.Task, model.Task.id == model.Module.task).\
                 filter(model.Task.evaluation_public).\
-                join(model.Wave, model.Wave.id == model.Task.wave).\
-                filter(model.Wave.year == req.context['year']).\
-                group_by(model.Evaluation.user, model.Evaluation.module).\
+                filter(model.BestScore.year == req.context['year']).\
                 subquery()
 
             # Pocet odevzdanych uloh (zahrnuje i module not evaluation_public
             # i napriklad automaticky opravovane moduly s 0 body).
             tasks_per_user = session.query(
-                model.Evaluation.user.label('user'),
-                func.count(distinct(model.Task.id)).label('tasks_cnt')
+                model.BestScore.user.label('user'),
+                func.count(distinct(model.Module.task)).label('tasks_cnt')
             ).\
                 join(model.Module,
-                     model.Evaluation.module == model.Module.id).\
-                join(model.Task, model.Task.id == model.Module.task).\
-                join(model.Wave, model.Wave.id == model.Task.wave).\
-                filter(model.Wave.year == req.context['year']).\
-                group_by(model.Evaluation.user).subquery()
+                     model.BestScore.module == model.Module.id).\
+                filter(model.BestScore.year == req.context['year']).\
+                group_by(model.BestScore.user).subquery()
 
             # Ziskame vsechny uzivatele
             # Tem, kteri maji evaluations, je prirazen pocet bodu a pocet
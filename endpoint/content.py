@@ -203,3 +203,5 @@ class TaskContent(object):
 
         resp.content_type = magic.Magic(mime=True).from_file(file_path)
         resp.set_stream(open(file_path, 'rb'), os.path.getsize(file_path))
+        # GzipCompression (app.py) posle predkomprimovanou variantu
+        resp.context['static_file'] = str(file_path)
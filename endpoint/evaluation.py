@@ -0,0 +1,37 @@
+import falcon
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import session
+import model
+import util
+
+
+class EvaluationStatus(object):
+    """ Stav asynchronniho opraveni (util/evaluation_job.py). """
+
+    # Viz app.py:DBSession (replika muze byt pozadu za stavem ulohy)
+    db_primary = True
+
+    def on_get(self, req, resp, id):
+        try:
+            user = req.context['user']
+            if not user.is_logged_in():
+                resp.status = falcon.HTTP_401
+                return
+
+            job = session.query(model.EvaluationJob).get(id)
+            if job is None:
+                resp.status = falcon.HTTP_404
+                return
+
+            evaluation = session.query(model.Evaluation).get(job.evaluation)
+            if evaluation.user != user.id and not user.is_org():
+                resp.status = falcon.HTTP_404
+                return
+
+            # Ulohu mohl ztratit ukonceny gunicorn worker
+            util.evaluation_job.recover(job)
+            req.context['result'] = util.evaluation_job.status_to_json(job)
+        except SQLAlchemyError:
+            session.rollback()
+            raise
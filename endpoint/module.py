@@ -6,7 +6,6 @@ import multipart
 from sqlalchemy import func, exc
 from sqlalchemy.exc import SQLAlchemyError
 import datetime
-import traceback
 
 from db import session
 from model import ModuleType
@@ -36,7 +35,9 @@ class Module(object):
                 resp.status = falcon.HTTP_404
             else:
                 task = session.query(model.Task).get(module.task)
-                if util.task.status(task, user) != util.TaskStatus.LOCKED:
+                status = util.task.TaskStatusResolver.for_task(task, user).\
+                    status(task)
+                if status != util.TaskStatus.LOCKED:
                     req.context['result'] = {
                         'module': util.module.to_json(module, user.id)
                     }
@@ -48,6 +49,8 @@ class Module(object):
 
 
 class ModuleSubmit(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def _upload_files(self, req, module, user_id, resp):
         # Soubory bez specifikace delky neberem.
@@ -156,6 +159,7 @@ class ModuleSubmit(object):
         try:
             session.add(evaluation)
             session.commit()
+            util.best_score.update(user_id, module.id)
         except SQLAlchemyError:
             session.rollback()
             raise
@@ -186,43 +190,19 @@ class ModuleSubmit(object):
 
             if not module.autocorrect:
                 session.commit()
+                util.best_score.update(user.id, module.id)
                 req.context['result'] = {'result': 'ok'}
                 return
 
-            reporter = util.programming.Reporter(max_size=50*1000)  # prevent database overflow
-
-            try:
-                result = util.programming.evaluate(
-                    module.task, module, user.id, data, evaluation.id, reporter
-                )
-            except util.programming.ENoFreeBox as e:
-                result = {
-                    'result': 'error',
-                    'message': ('Přesáhnut maximální počet souběžně běžících '
-                                'opravení, zkuste to za chvíli.')
-                }
-            except Exception:
-                reporter += 'Zachycena chyba:\n'
-                reporter += traceback.format_exc()
-                result = {
-                    'result': 'error',
-                    'message': ('Nastala chyba při vykonávání kódu, zkus to prosím znovu později'
-                                ' a v případě přetrvávající chyby kontaktuj organizátora')
-                }
-
-            evaluation.points = result['score'] if 'score' in result else 0
-            evaluation.ok = (result['result'] == 'ok')
-            evaluation.full_report += (str(datetime.datetime.now()) + " : " +
-                                       reporter.report_truncated + '\n')
-            session.commit()
-
-            if 'actions' in result:
-                for action in result['actions']:
-                    reporter += "Performing %s...\n" % (action)
-                    util.module.perform_action(module, user, action)
+            if req.get_param_as_bool('async',
+                                     default=util.evaluation_job.ASYNC_DEFAULT):
+                job = util.evaluation_job.enqueue(evaluation)
+                resp.status = falcon.HTTP_202
+                req.context['result'] = util.evaluation_job.status_to_json(job)
+                return
 
-            if user.is_org():
-                result['report'] = reporter.report_truncated
+            result = util.evaluation_job.evaluate_submission(
+                module, user, evaluation, data)
 
             req.context['result'] = result
         except SQLAlchemyError:
@@ -255,8 +235,7 @@ class ModuleSubmit(object):
                 return
 
             # Po deadlinu nelze POSTovat reseni
-            if session.query(model.Task).get(module.task).time_deadline < \
-                    datetime.datetime.utcnow():
+            if module.task in util.task.after_deadline():
                 req.context['result'] = {
                     'result': 'error',
                     'error': 'Nelze odevzdat po termínu odevzdání úlohy'
@@ -343,6 +322,7 @@ class ModuleSubmit(object):
 
             session.add(evaluation)
             session.commit()
+            util.best_score.update(user.id, module.id)
         except SQLAlchemyError:
             session.rollback()
             raise
@@ -351,6 +331,8 @@ class ModuleSubmit(object):
 
 
 class ModuleSubmittedFile(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def _get_submitted_file(self, req, resp, id):
         user = req.context['user']
@@ -431,8 +413,11 @@ class ModuleSubmittedFile(object):
                             filter(model.SubmittedFile.evaluation == eval_id).\
                             count()
                         if files_cnt == 0:
+                            eval_user = evaluation.user
+                            eval_module = evaluation.module
                             session.delete(evaluation)
                             session.commit()
+                            util.best_score.update(eval_user, eval_module)
 
                     req.context['result'] = {'status': 'ok'}
 
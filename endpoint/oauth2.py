@@ -70,9 +70,12 @@ class Authorize(object):
                 model.Token.refresh_token == refresh_token).first()
 
             if token:
+                access_token = token.access_token
                 session.delete(token)
                 user = session.query(model.User).get(token.user)
+                # OAuth2Token commitne i smazani stareho tokenu
                 req.context['result'] = auth.OAuth2Token(user).data
+                util.auth.revoke_token(access_token)
             else:
                 req.context['result'] = {'error': Error.UNAUTHORIZED_CLIENT}
                 resp.status = falcon.HTTP_400
@@ -83,7 +86,7 @@ class Authorize(object):
     def on_post(self, req, resp):
         try:
             grant_type = req.get_param('grant_type')
-            util.auth.update_tokens()
+            util.auth.sweeper.trigger()
 
             if grant_type == 'password':
                 self._auth(req, resp)
@@ -100,6 +103,8 @@ class Authorize(object):
 
 
 class Logout(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def on_get(self, req, resp):
         try:
@@ -115,6 +120,7 @@ class Logout(object):
 
             session.delete(token)
             session.commit()
+            util.auth.revoke_token(req.context['user'].token)
         except SQLAlchemyError:
             session.rollback()
             raise
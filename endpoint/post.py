@@ -187,7 +187,7 @@ class Posts(object):
             #     tato situace nastava pri POSTovani prnviho prispevku
             #     k opravovani, protoze vlakno opravovani jeste neni sprazeno
             #     s evaluation.
-            if (task_thread and util.task.status(task_thread, user) == util.TaskStatus.LOCKED) or \
+            if (task_thread and util.task.TaskStatusResolver.for_task(task_thread, user).status(task_thread) == util.TaskStatus.LOCKED) or \
                 (solution_thread and (solution_thread.user != user.id and not user.is_org())) or \
                     (not thread.public and not solution_thread and not user.is_org()):
                 resp.status = falcon.HTTP_400
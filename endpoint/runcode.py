@@ -10,6 +10,8 @@ import util
 
 
 class RunCode(object):
+    # Viz app.py:DBSession
+    db_primary = True
 
     def on_post(self, req, resp, id):
         try:
@@ -25,8 +27,9 @@ class RunCode(object):
                 resp.status = falcon.HTTP_404
                 return
 
-            task_status = util.task.status(session.query(model.Task).
-                                           get(module.task), user)
+            task = session.query(model.Task).get(module.task)
+            task_status = util.task.TaskStatusResolver.for_task(task, user).\
+                status(task)
 
             if task_status == util.TaskStatus.LOCKED:
                 resp.status = falcon.HTTP_403
@@ -42,7 +42,8 @@ class Task(object):
                 'task': util.task.to_json(
                     task,
                     prereq_obj=task.prerequisite_obj,
-                    user=user
+                    user=user,
+                    resolver=util.task.TaskStatusResolver.for_task(task, user)
                 )
             }
         except SQLAlchemyError:
@@ -68,21 +69,18 @@ class Tasks(object):
                 tasks = tasks.filter(model.Wave.public)
             tasks = tasks.filter(model.Wave.year == req.context['year']).all()
 
-            adeadline = util.task.after_deadline()
-            fsubmitted = util.task.fully_submitted(
-                user.id,
-                req.context['year']
+            resolver = util.task.TaskStatusResolver(
+                user, req.context['year'],
+                waves={wave.id: wave for (_, wave, _) in tasks}
             )
-            corrected = util.task.corrected(user.id)
-            autocorrected_full = util.task.autocorrected_full(user.id)
             task_max_points_dict = util.task.max_points_dict()
 
             req.context['result'] = {
                 'tasks': [
                     util.task.to_json(
-                        task, prereq, user, adeadline, fsubmitted, wave,
-                        task.id in corrected, task.id in autocorrected_full,
-                        task_max_points=task_max_points_dict[task.id]
+                        task, prereq, user, wave=wave,
+                        task_max_points=task_max_points_dict[task.id],
+                        resolver=resolver
                     )
                     for (task, wave, prereq) in tasks
                 ]
@@ -110,7 +108,8 @@ class TaskDetails(object):
                 }
                 resp.status = falcon.HTTP_404
                 return
-            status = util.task.status(task, user)
+            status = util.task.TaskStatusResolver.for_task(task, user).\
+                status(task)
 
             if status == util.TaskStatus.LOCKED:
                 req.context['result'] = {
@@ -127,6 +126,9 @@ class TaskDetails(object):
             scores = util.task.points_per_module(id, user.id)
             best_scores = util.task.best_scores(id)
 
+            modules = task.modules
+            modules_data = util.module.load_user_data(modules, user.id)
+
             comment_thread = util.task.comment_thread(id, user.id)
             thread_ids = {task.thread, comment_thread}
             threads = [
@@ -143,8 +145,8 @@ class TaskDetails(object):
                     comment_thread
                 ),
                 'modules': [
-                    util.module.to_json(module, user.id)
-                    for module in task.modules
+                    util.module.to_json(module, user.id, modules_data)
+                    for module in modules
                 ],
                 'moduleScores': [
                     util.module.score_to_json(score)
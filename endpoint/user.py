@@ -8,7 +8,7 @@ from sqlalchemy import func, distinct, desc, text, or_, select
 from sqlalchemy.exc import SQLAlchemyError
 import traceback
 
-from db import session
+from db import on_primary, session
 import model
 import model.user
 import util
@@ -74,6 +74,7 @@ class User(object):
                 session.delete(profile)
             session.delete(user_db)
             session.commit()
+            util.auth.invalidate_tokens()
         except SQLAlchemyError:
             session.rollback()
             raise
@@ -132,9 +133,46 @@ class DiscordBotValidateUser(object):
 
 class Users(object):
 
+    # Serializovane vysledkovky per (rocnik, filtr, razeni, admin_data,
+    # pretty).
+    # Platnost je svazana s verzi bodu rocniku (util.cache.scores_version).
+    snapshots = util.cache.SnapshotCache()
+
     def on_get(self, req, resp):
         filt = req.get_param('filter')
         sort = req.get_param('sort')
+        try:
+            year_id = int(req.context['year'])
+        except (TypeError, ValueError):
+            # Neplatna hlavicka YEAR
+            resp.status = falcon.HTTP_400
+            return
+        admin_data = req.context['user'].is_org()
+        pretty = util.serialization.pretty_requested(req)
+
+        key = (year_id, filt, sort, admin_data, pretty)
+        version = util.cache.scores_version(year_id)
+        snapshot = self.snapshots.get(key, version)
+        if snapshot is None:
+            # Snapshot se uklada pod aktualni verzi, replika muze byt za
+            # touto verzi pozadu
+            with on_primary():
+                users = self._users_json(req, filt, sort)
+            snapshot = self.snapshots.put(
+                key, version,
+                util.encode_json({'users': users}, pretty=pretty)
+            )
+
+        resp.etag = snapshot.etag
+        if req.if_none_match and (snapshot.etag in req.if_none_match or
+                                  '*' in req.if_none_match):
+            resp.status = falcon.HTTP_304
+            return
+
+        resp.content_type = falcon.MEDIA_JSON
+        resp.text = snapshot.body
+
+    def _users_json(self, req, filt, sort):
         usr = req.context['user']
         year = req.context['year_obj']
 
@@ -148,32 +186,29 @@ class Users(object):
 
         try:
             # Skore uzivatele per modul (zahrnuje jen moduly evaluation_public)
+            # MAX(points) per (user, module) je predpocitan v best_scores.
             per_user = session.query(
-                model.Evaluation.user.label('user'),
-                func.max(model.Evaluation.points).label('points'),
-                func.max(model.Evaluation.cheat).label('cheat'),
+                model.BestScore.user.label('user'),
+                model.BestScore.points.label('points'),
+                model.BestScore.cheat.label('cheat'),
             ).\
                 join(model.Module,
-                     model.Evaluation.module == model.Module.id).\
+                     model.BestScore.module == model.Module.id).\
                 join(model.Task, model.Task.id == model.Module.task).\
                 filter(model.Task.evaluation_public).\
-                join(model.Wave, model.Wave.id == model.Task.wave).\
-                filter(model.Wave.year == req.context['year']).\
-                group_by(model.Evaluation.user, model.Evaluation.module).\
+                filter(model.BestScore.year == req.context['year']).\
                 subquery()
 
             # Pocet odevzdanych uloh (zahrnuje i module not evaluation_public
             # i napriklad automaticky opravovane moduly s 0 body)
             tasks_per_user = session.query(
-                model.Evaluation.user.label('user'),
-                func.count(distinct(model.Task.id)).label('tasks_cnt')
+                model.BestScore.user.label('user'),
+                func.count(distinct(model.Module.task)).label('tasks_cnt')
             ).\
                 join(model.Module,
-                     model.Evaluation.module == model.Module.id).\
-                join(model.Task, model.Task.id == model.Module.task).\
-                join(model.Wave, model.Wave.id == model.Task.wave).\
-                filter(model.Wave.year == req.context['year']).\
-                group_by(model.Evaluation.user).subquery()
+                     model.BestScore.module == model.Module.id).\
+                filter(model.BestScore.year == req.context['year']).\
+                group_by(model.BestScore.user).subquery()
 
             # Ziskame vsechny uzivatele
             # Tem, kteri maji evaluations, je prirazen pocet bodu a
@@ -251,15 +286,9 @@ class Users(object):
                 all()
 
             # Aktivni roky:
-            seasons = session.query(model.Year.id.label('year_id'),
-                                    model.User.id.label('user_id')).\
-                join(model.Wave, model.Wave.year == model.Year.id).\
-                join(model.Task, model.Task.wave == model.Wave.id).\
-                join(model.Module, model.Module.task == model.Task.id).\
-                join(model.Evaluation,
-                     model.Evaluation.module == model.Module.id).\
-                join(model.User, model.Evaluation.user == model.User.id).\
-                group_by(model.User.id, model.Year.id).\
+            seasons = session.query(model.BestScore.year.label('year_id'),
+                                    model.BestScore.user.label('user_id')).\
+                group_by(model.BestScore.user, model.BestScore.year).\
                 all()
 
             # Aktivni roky orgu:
@@ -292,6 +321,24 @@ class Users(object):
             # -> nastavime jim natvrdo 'tasks_cnt' = 0 a total_score = 0,
             # abychom omezili dalsi SQL dotazy v util.user.to_json
 
+            # Seznamy patrici kazdemu uzivateli rozdelime jednim pruchodem
+            # do slovniku user_id -> [...], misto filtrovani celych seznamu
+            # pro kazdeho uzivatele.
+            achs_by_user = util.grouping.group_by(
+                achievements, lambda item: item.user_id,
+                lambda item: item.a_id)
+            seasons_by_user = util.grouping.group_by(
+                seasons, lambda item: item.user_id, lambda item: item.year_id)
+            org_seasons_by_user = util.grouping.group_by(
+                org_seasons, lambda item: item.user_id,
+                lambda item: item.year_id)
+            tasks_by_user = util.grouping.group_by(
+                users_tasks, lambda usr_task: usr_task[0].id,
+                lambda usr_task: usr_task[1])
+            co_tasks_by_user = util.grouping.group_by(
+                users_co_tasks, lambda usr_task: usr_task[0].id,
+                lambda usr_task: usr_task[1])
+
             users_json = [
                 util.user.to_json(
                     user=user.User,
@@ -299,31 +346,13 @@ class Users(object):
                     total_score=user.total_score if user.total_score else 0,
                     tasks_cnt=user.tasks_cnt if user.tasks_cnt else 0,
                     profile=user.Profile,
-                    achs=[item.a_id for item in achievements
-                          if item.user_id == user.User.id],
-                    seasons=[item.year_id for item in seasons
-                             if item.user_id == user.User.id],
-                    users_tasks=[
-                        task for (_, task) in [
-                            usr_task
-                            for usr_task in users_tasks
-                            if usr_task[0].id == user.User.id
-                        ]
-                    ] if users_tasks else None,
+                    achs=achs_by_user.get(user.User.id, []),
+                    seasons=seasons_by_user.get(user.User.id, []),
+                    users_tasks=tasks_by_user.get(user.User.id, []),
                     admin_data=req.context['user'].is_org(),
-                    org_seasons=[
-                        item.year_id
-                        for item in org_seasons if item.user_id == user.User.id
-                    ],
+                    org_seasons=org_seasons_by_user.get(user.User.id, []),
                     max_points=max_points,
-                    users_co_tasks=[
-                        task for (_, task) in [
-                            usr_task1
-                            for usr_task1 in users_co_tasks
-                            if usr_task1[0].id == user.User.id
-                        ]
-                    ]
-                    if users_co_tasks else None,
+                    users_co_tasks=co_tasks_by_user.get(user.User.id, []),
                     cheat=user.cheat,
                 )
 
@@ -335,9 +364,7 @@ class Users(object):
         finally:
             session.close()
 
-        req.context['result'] = {
-            'users': users_json
-        }
+        return users_json
 
 
 class ChangePassword(object):
@@ -371,6 +398,7 @@ class ChangePassword(object):
         try:
             session.add(user)
             session.commit()
+            util.auth.invalidate_tokens()
         except SQLAlchemyError:
             session.rollback()
             raise
@@ -417,6 +445,7 @@ class ForgottenPassword(object):
         try:
             session.add(user)
             session.commit()
+            util.auth.invalidate_tokens()
         except SQLAlchemyError:
             session.rollback()
             raise
@@ -90,6 +90,7 @@ class Wave(object):
 
             session.delete(wave)
             session.commit()
+            util.task.invalidate_max_points()
             req.context['result'] = {}
 
         except SQLAlchemyError:
@@ -146,6 +147,7 @@ class Waves(object):
 
             session.add(wave)
             session.commit()
+            util.task.invalidate_max_points()
             req.context['result'] = {'wave': util.wave.to_json(wave)}
         except SQLAlchemyError:
             session.rollback()
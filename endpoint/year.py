@@ -64,6 +64,7 @@ class Year(object):
                 session.add(org)
 
             session.commit()
+            util.year.years.invalidate()
 
         except SQLAlchemyError:
             session.rollback()
@@ -98,6 +99,8 @@ class Year(object):
 
             session.delete(year)
             session.commit()
+            util.year.years.invalidate()
+            util.task.invalidate_max_points()
             req.context['result'] = {}
 
         except SQLAlchemyError:
@@ -153,6 +156,8 @@ class Years(object):
 
             session.add(year)
             session.commit()
+            util.year.years.invalidate()
+            util.task.invalidate_max_points()
 
             if 'active_orgs' in data:
                 for user_id in data['active_orgs']:
@@ -10,6 +10,7 @@
 cd "$(dirname "$(realpath "$0")")" || { echo "ERR: Cannot cd to script dir"; exit 1; }
 
 echo -n "[*] Making data directories..."
+mkdir -p data/cache
 mkdir -p data/code_executions
 mkdir -p data/content/achievements data/content/articles
 mkdir -p data/images
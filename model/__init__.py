@@ -27,3 +27,5 @@ from model.feedback import Feedback
 from model.user_notify import UserNotify
 from model.diploma import Diploma
 
+from model.best_score import BestScore
+from model.evaluation_job import EvaluationJob
@@ -0,0 +1,32 @@
+from sqlalchemy import (Column, Integer, Boolean, ForeignKey, DECIMAL, Index,
+                        text)
+
+from . import Base
+from .user import User
+from .module import Module
+from .year import Year
+
+
+class BestScore(Base):
+    """Materializovany MAX(points) a MAX(cheat) z 'evaluations' pro kazdou
+    dvojici (user, module). Udrzuje util.best_score, znovu sestavit lze
+    prikazem `python rebuild_best_scores.py [--year YEAR_ID]`.
+    """
+    __tablename__ = 'best_scores'
+    __table_args__ = (
+        Index('ix_best_scores_year_user', 'year', 'user'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+        })
+
+    user = Column(Integer, ForeignKey(User.id, ondelete='CASCADE'),
+                  primary_key=True, nullable=False)
+    module = Column(Integer, ForeignKey(Module.id, ondelete='CASCADE'),
+                    primary_key=True, nullable=False)
+    points = Column(DECIMAL(precision=10, scale=1, asdecimal=False),
+                    nullable=False, default=0)
+    cheat = Column(Boolean, nullable=False, default=False,
+                   server_default=text('FALSE'))
+    year = Column(Integer, ForeignKey(Year.id, ondelete='CASCADE'),
+                  nullable=False)
@@ -0,0 +1,36 @@
+import datetime
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Enum, Index
+from sqlalchemy.types import TIMESTAMP
+
+from . import Base
+from .evaluation import Evaluation
+
+
+class EvaluationJob(Base):
+    """Asynchronni opraveni odevzdaneho kodu (util/evaluation_job.py).
+    Id ulohy je id jejiho 'evaluation'.
+    Beziciho ulohu drzi 'worker' do 'lease_expires' (worker lease
+    prubezne prodluzuje), po vyprseni ji muze prevzit jiny worker."""
+    __tablename__ = 'evaluation_jobs'
+    __table_args__ = (
+        Index('ix_evaluation_jobs_status_created', 'status', 'created'),
+        {
+            'mysql_engine': 'InnoDB',
+            'mysql_charset': 'utf8mb4',
+        })
+
+    evaluation = Column(Integer,
+                        ForeignKey(Evaluation.id, ondelete='CASCADE'),
+                        primary_key=True, nullable=False)
+    status = Column(Enum('queued', 'running', 'done', 'error'),
+                    nullable=False, default='queued')
+    # JSON odpovedi, kterou by vratil synchronni ModuleSubmit
+    result = Column(Text)
+    created = Column(TIMESTAMP, default=datetime.datetime.utcnow,
+                     nullable=False)
+    started = Column(TIMESTAMP, nullable=True)
+    finished = Column(TIMESTAMP, nullable=True)
+    # hostname:pid:nahodny token zabrani ulohy (util.evaluation_job.claim)
+    worker = Column(String(150), nullable=True)
+    lease_expires = Column(TIMESTAMP, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0)
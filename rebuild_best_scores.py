@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+
+"""
+Znovu sestavi tabulku 'best_scores' z tabulky 'evaluations'.
+Pouziti (z korenoveho adresare backendu):
+    python rebuild_best_scores.py [--year YEAR_ID]
+"""
+
+import argparse
+
+import util
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Rebuild materialized best_scores table from evaluations"
+    )
+    parser.add_argument('--year', type=int, default=None,
+                        help="rebuild only this year (default: all years)")
+    args = parser.parse_args()
+
+    rows = util.best_score.rebuild(args.year)
+    print(f"Rebuilt best_scores: {rows} rows"
+          + (f" (year {args.year})" if args.year is not None else ""))
+
+
+if __name__ == '__main__':
+    main()
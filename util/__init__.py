@@ -3,6 +3,7 @@ import cgi
 from .auth import UserInfo
 from .prerequisite import PrerequisitiesEvaluator
 from .task import TaskStatus
+from .serialization import encode_json
 
 from . import admin
 
@@ -31,6 +32,16 @@ from . import lock
 from . import feedback
 from . import user_notify
 from . import logger
+from . import best_score
+from . import cache
+from . import grouping
+from . import serialization
+from . import compression
+from . import querystats
+from . import metrics
+from . import profiling
+from . import access_log
+from . import evaluation_job
 
 
 def decode_form_data(req):
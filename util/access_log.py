@@ -0,0 +1,115 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import sys
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+from threading import Lock
+from typing import Any, Dict, Optional
+
+import config
+
+"""
+Access log HTTP pozadavku (app.py:log).
+
+Pozadavek jen vlozi zaznam do fronty (QueueHandler), formatovani a zapis na
+stdout provadi vlakno na pozadi (QueueListener), obsluha pozadavku tedy
+neceka na I/O.
+
+Format vystupu nastavuje ACCESS_LOG_FORMAT v config.py:
+ * 'plain' (default): puvodni radek '[cas] [INFO] [HTTP] [ip] [metoda]
+   [status] [uzivatel] [SQL dotazy a cas] uri' doplneny o latenci,
+ * 'json': jeden JSON objekt na radek.
+"""
+
+FORMAT = getattr(config, 'ACCESS_LOG_FORMAT', 'plain')
+
+
+class PlainFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        a = record.access
+        sql = (f"{a['db_queries']}q {a['db_ms']:.1f}ms"
+               if a['db_queries'] is not None else '_')
+        latency = f"{a['latency_ms']:.1f}ms" if a['latency_ms'] is not None \
+            else '_'
+        return (f"[{a['time'][:19].replace('T', ' ')}] "
+                f"[INFO] [HTTP] "
+                f"[{a['ip']}] "
+                f"[{a['method']}] "
+                f"[{a['status']}] "
+                f"[{a['user'] if a['user'] is not None else '_'}] "
+                f"[{sql}] "
+                f"[{latency}] "
+                f"{a['uri']}")
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.access, ensure_ascii=False)
+
+
+class AccessLog:
+    """Logger 'ksi.access' s frontou a vlaknem na zapis. Vlakno se spousti
+    az pri prvnim zaznamu v kazdem procesu (gunicorn workery vznikaji
+    forkem)."""
+
+    def __init__(self, format_: str) -> None:
+        self.__lock = Lock()
+        self.__pid: Optional[int] = None
+        self.__listener: Optional[QueueListener] = None
+        self.__format = format_
+        self.logger = logging.getLogger('ksi.access')
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+    def __start(self) -> None:
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            log_queue: queue.SimpleQueue = queue.SimpleQueue()
+            output = logging.StreamHandler(sys.stdout)
+            output.setFormatter(JSONFormatter() if self.__format == 'json'
+                                else PlainFormatter())
+            for handler in list(self.logger.handlers):
+                self.logger.removeHandler(handler)
+            self.logger.addHandler(QueueHandler(log_queue))
+            self.__listener = QueueListener(log_queue, output)
+            self.__listener.start()
+            self.__pid = os.getpid()
+
+    def stop(self) -> None:
+        """Vypise zbyle zaznamy z fronty a ukonci vlakno"""
+        with self.__lock:
+            if self.__listener is not None and self.__pid == os.getpid():
+                self.__listener.stop()
+            self.__listener = None
+            self.__pid = None
+
+    def write(self, fields: Dict[str, Any]) -> None:
+        if self.__pid != os.getpid():
+            self.__start()
+        self.logger.info('', extra={'access': fields})
+
+
+access_log = AccessLog(FORMAT)
+atexit.register(access_log.stop)
+
+
+def log(req, resp) -> None:
+    """Zapise pozadavek 'req' s odpovedi 'resp' do access logu"""
+    user = req.context.get('user')
+    stats = req.context.get('query_stats')
+    access_log.write({
+        'time': datetime.now().isoformat(timespec='milliseconds'),
+        'ip': req.context.get('source_ip'),
+        'method': req.method,
+        'route': req.uri_template,
+        'uri': req.relative_uri,
+        'status': int(resp.status.split()[0]),
+        'user': user.id if user else None,
+        'latency_ms': round(stats.elapsed * 1000, 1) if stats else None,
+        'db_ms': round(stats.db_time * 1000, 1) if stats else None,
+        'db_queries': stats.count if stats else None,
+    })
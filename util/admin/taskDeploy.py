@@ -148,6 +148,10 @@ def deploy(task_id: int, year_id: int, deployLock: LockFile, scoped: Callable) -
             thread.title = task.title
 
         session.commit()
+
+        # Deploy meni moduly i zverejneni hodnoceni -> zneplatnime
+        # vysledkovky
+        util.cache.bump_scores_version(task.wave_.year)
     except Exception as e:
         exc_type, exc_obj, exc_tb = sys.exc_info()
         log("Exception: " + traceback.format_exc(), task=task_id)
@@ -158,6 +162,11 @@ def deploy(task_id: int, year_id: int, deployLock: LockFile, scoped: Callable) -
         except BaseException:
             session.rollback()
     finally:
+        # Moduly, deadline i prerekvizity se mohly zmenit i pri neuspesnem
+        # deployi, task.prerequisite je uz commitnuta
+        util.task.invalidate_max_points()
+        util.task.invalidate_deadlines()
+        util.prerequisite.invalidate()
         if deployLock.is_locked():
             deployLock.release()
         log("Done")
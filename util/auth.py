@@ -1,16 +1,36 @@
 import datetime
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from threading import Lock
+from time import time
+from typing import NamedTuple, Optional
 
-from db import session
+from sqlalchemy.exc import SQLAlchemyError
+
+from db import session, _session
 import model
+import util.cache
+from util.logger import get_log
 
 
 class UserInfo:
 
-    def __init__(self, user=None, token=None):
-        self.id = user.id if user else None
-        self.role = user.role if user else None
+    def __init__(self, user=None, token=None,
+                 user_id: Optional[int] = None, role: Optional[str] = None):
+        """Bud 'user' (model.User), nebo 'user_id' a 'role' (z TokenCache),
+        model.User se pak nacte az pri prvnim pristupu k 'user'."""
+        self.id = user.id if user else user_id
+        self.role = user.role if user else role
         self.token = token
-        self.user = user
+        self._user = user
+
+    @property
+    def user(self):
+        if self._user is None and self.id is not None:
+            self._user = session.query(model.User).get(self.id)
+        return self._user
 
     def is_logged_in(self):
         return self.id is not None
@@ -28,20 +48,197 @@ class UserInfo:
         return self.role == 'tester'
 
 
-def update_tokens():
+class TokenEntry(NamedTuple):
+    user_id: int
+    role: str
+    expire: datetime.datetime
+    cached: float
+
+
+class TokenCache:
+    """
+    LRU cache access_token -> (user_id, role, expire) v pameti workeru.
+    Pri miss se token i uzivatel nactou jednim dotazem. Zaznam je platny
+    nejdele 'ttl' sekund (pojistka pro zmeny primo v databazi, napr. zmena
+    role), do odvolani tokenu (revoke(), znacka v REVOKED_DIR) a do zmeny
+    verze util.cache 'auth-tokens' (invalidate(), zmena vice tokenu).
+    Expiraci tokenu (Token.expire) kontroluje volajici.
+    """
+
+    VERSION_KEY = 'auth-tokens'
+    REVOKED_DIR = os.path.join(util.cache.CACHE_DIR, 'revoked-tokens')
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__entries: "OrderedDict[str, TokenEntry]" = OrderedDict()
+        self.__version: Optional[str] = None
+        self.__lock = Lock()
+
+    def lookup(self, token: str) -> Optional[TokenEntry]:
+        ver = util.cache.version(self.VERSION_KEY)
+        with self.__lock:
+            if ver != self.__version:
+                self.__entries.clear()
+                self.__version = ver
+            entry = self.__entries.get(token)
+            if entry is not None and time() - entry.cached <= self.ttl:
+                self.__entries.move_to_end(token)
+            else:
+                entry = None
+        if entry is not None:
+            if not os.path.exists(self.__revoked_path(token)):
+                return entry
+            with self.__lock:
+                self.__entries.pop(token, None)
+
+        row = session.query(model.Token.expire, model.User.id,
+                            model.User.role).\
+            join(model.User, model.User.id == model.Token.user).\
+            filter(model.Token.access_token == token).\
+            first()
+        if row is None:
+            with self.__lock:
+                self.__entries.pop(token, None)
+            return None
+
+        entry = TokenEntry(user_id=row.id, role=row.role, expire=row.expire,
+                           cached=time())
+        with self.__lock:
+            if self.__version == ver:
+                self.__entries[token] = entry
+                self.__entries.move_to_end(token)
+                while len(self.__entries) > self.max_entries:
+                    self.__entries.popitem(last=False)
+        return entry
+
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+        util.cache.bump(self.VERSION_KEY)
+
+    def revoke(self, token: str) -> None:
+        """Odebere 'token' z cache vsech workeru. Volat az po commitu
+        smazani tokenu, jinak ho jiny worker muze znovu nacist."""
+        with self.__lock:
+            self.__entries.pop(token, None)
+        try:
+            os.makedirs(self.REVOKED_DIR, exist_ok=True)
+            with open(self.__revoked_path(token), 'w'):
+                pass
+            self.__prune_revoked()
+        except OSError as e:
+            get_log().error(f"Cannot revoke cached token: {e}")
+
+    def __revoked_path(self, token: str) -> str:
+        return os.path.join(self.REVOKED_DIR,
+                            hashlib.sha256(token.encode('utf-8')).hexdigest())
+
+    def __prune_revoked(self) -> None:
+        # Zaznamy v cache jsou platne nejdele 'ttl' sekund, starsi znacky
+        # uz nejsou potreba (2x ttl jako rezerva pro prave nacitane tokeny)
+        cutoff = time() - 2 * self.ttl
+        for entry in os.scandir(self.REVOKED_DIR):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+tokens = TokenCache()
+
+
+def invalidate_tokens() -> None:
+    """Zneplatni celou cache tokenu ve vsech workerech. Volat pri zmene
+    vice tokenu najednou (zmena hesla ci role, smazani uzivatele)."""
+    tokens.invalidate()
+
+
+def revoke_token(access_token: str) -> None:
+    """Zneplatni jeden token v cache vsech workeru (odhlaseni, obnoveni
+    tokenu). Volat po commitu smazani tokenu."""
+    tokens.revoke(access_token)
+
+
+# refresh token nechavame v databazi jeste 14 dni po expiraci, aby se
+# uzivatel mohl znovu prihlasit automaticky (napriklad po uspani pocitace)
+TOKEN_KEEP_AFTER_EXPIRE = datetime.timedelta(days=14)
+SWEEP_BATCH_SIZE = 1000
+SWEEP_INTERVAL = 3600  # [s]
+
+
+def sweep_expired_tokens(batch_size: int = SWEEP_BATCH_SIZE) -> int:
+    """Smaze tokeny expirovane pred vice nez TOKEN_KEEP_AFTER_EXPIRE.
+    Maze po davkach 'batch_size' radku (indexovany sloupec expire), kazda
+    davka je samostatna transakce, takze nedrzi zamky dlouho.
+    Pouziva vlastni session, lze volat z jineho vlakna.
+    Vraci pocet smazanych tokenu.
+    """
+    cutoff = datetime.datetime.utcnow() - TOKEN_KEEP_AFTER_EXPIRE
+    sweep_session = _session()
+    removed = 0
     try:
-        # refresh token nechavame v databazi jeste den, aby se uzivatel mohl
-        # znovu prihlasit automaticky (napriklad po uspani pocitace)
-        tokens = session.query(model.Token).all()
-        tokens = [
-            token
-            for token in tokens
-            if (datetime.datetime.utcnow() >
-                token.expire+datetime.timedelta(days=14))
-        ]
-        for token in tokens:
-            session.delete(token)
-        session.commit()
-    except:
-        session.rollback()
+        while True:
+            batch = [
+                access_token for (access_token, ) in
+                sweep_session.query(model.Token.access_token).
+                filter(model.Token.expire < cutoff).
+                limit(batch_size).
+                all()
+            ]
+            if not batch:
+                break
+
+            removed += sweep_session.query(model.Token).\
+                filter(model.Token.access_token.in_(batch)).\
+                delete(synchronize_session=False)
+            sweep_session.commit()
+
+            if len(batch) < batch_size:
+                break
+    except SQLAlchemyError:
+        sweep_session.rollback()
         raise
+    finally:
+        sweep_session.close()
+
+    return removed
+
+
+class TokenSweeper:
+    """
+    Uklid expirovanych tokenu na pozadi. trigger() jen spusti vlakno
+    (nejvyse jednou za 'interval' sekund a jen pokud uklid uz neprobiha),
+    pozadavek na uklid tedy nikdy neceka.
+    """
+
+    def __init__(self, interval: float = SWEEP_INTERVAL) -> None:
+        self.interval = interval
+        self.__last = 0.0
+        self.__thread: Optional[threading.Thread] = None
+        self.__lock = Lock()
+
+    def trigger(self) -> None:
+        with self.__lock:
+            if self.__thread is not None and self.__thread.is_alive():
+                return
+            if time() - self.__last < self.interval:
+                return
+            self.__last = time()
+            self.__thread = threading.Thread(target=self.__run,
+                                             name='token-sweeper',
+                                             daemon=True)
+            self.__thread.start()
+
+    def __run(self) -> None:
+        start = time()
+        try:
+            removed = sweep_expired_tokens()
+            get_log().info(f"Token sweeper removed {removed} expired tokens "
+                           f"in {time() - start:.2f} s")
+        except Exception:
+            get_log().exception("Token sweeper failed")
+
+
+sweeper = TokenSweeper()
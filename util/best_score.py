@@ -0,0 +1,120 @@
+from typing import Optional
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from db import session
+import model
+import util
+
+"""
+Tabulka 'best_scores' drzi pro kazdou dvojici (user, module) nejlepsi
+ziskany pocet bodu a priznak podvodu. Vysledkovka, export resitelu a
+vypocty bodu uzivatele ctou z teto tabulky misto agregace nad celou
+tabulkou 'evaluations'.
+
+Tabulku je nutne aktualizovat funkci update() po kazde zmene evaluation
+(vytvoreni, oprava, smazani). Pro zpetne naplneni slouzi rebuild(),
+resp. skript rebuild_best_scores.py.
+"""
+
+
+def _year_of_module(module_id: int) -> Optional[int]:
+    return session.query(model.Wave.year).\
+        join(model.Task, model.Task.wave == model.Wave.id).\
+        join(model.Module, model.Module.task == model.Task.id).\
+        filter(model.Module.id == module_id).\
+        scalar()
+
+
+def _update(user_id: int, module_id: int) -> None:
+    points, cheat, cnt = session.query(
+        func.max(model.Evaluation.points),
+        func.max(model.Evaluation.cheat),
+        func.count(model.Evaluation.id),
+    ).\
+        filter(model.Evaluation.user == user_id,
+               model.Evaluation.module == module_id).\
+        one()
+
+    best = session.query(model.BestScore).get((user_id, module_id))
+
+    if cnt == 0:
+        if best is not None:
+            year_id = best.year
+            session.delete(best)
+            session.commit()
+            util.cache.bump_scores_version(year_id)
+        return
+
+    if best is None:
+        best = model.BestScore(user=user_id, module=module_id,
+                               year=_year_of_module(module_id))
+        session.add(best)
+
+    best.points = points if points is not None else 0
+    best.cheat = bool(cheat)
+    year_id = best.year
+    session.commit()
+    util.cache.bump_scores_version(year_id)
+
+
+def update(user_id: int, module_id: int) -> None:
+    """Prepocita radek 'best_scores' pro dvojici (user_id, module_id) z
+    tabulky 'evaluations'. Radek se vytvori, upravi nebo smaze (pokud uz
+    zadne evaluation neexistuje). Prepocet je per dvojice, takze funguje i
+    pro snizeni bodu pri oprave.
+    """
+    try:
+        _update(user_id, module_id)
+    except IntegrityError:
+        # Radek mezitim vytvoril jiny worker, staci prepocitat znovu.
+        session.rollback()
+        _update(user_id, module_id)
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+
+
+def rebuild(year_id: Optional[int] = None) -> int:
+    """Znovu sestavi tabulku 'best_scores' z 'evaluations'.
+    Pokud je vyplnen 'year_id', prepocita jen dany rocnik.
+    Vraci pocet vytvorenych radku.
+    """
+    try:
+        old = session.query(model.BestScore)
+        if year_id is not None:
+            old = old.filter(model.BestScore.year == year_id)
+        old.delete(synchronize_session=False)
+
+        best = select(
+            model.Evaluation.user,
+            model.Evaluation.module,
+            func.max(model.Evaluation.points),
+            func.max(model.Evaluation.cheat),
+            model.Wave.year,
+        ).\
+            join(model.Module, model.Evaluation.module == model.Module.id).\
+            join(model.Task, model.Task.id == model.Module.task).\
+            join(model.Wave, model.Wave.id == model.Task.wave)
+        if year_id is not None:
+            best = best.where(model.Wave.year == year_id)
+        best = best.group_by(model.Evaluation.user, model.Evaluation.module,
+                             model.Wave.year)
+
+        result = session.execute(
+            insert(model.BestScore).from_select(
+                ['user', 'module', 'points', 'cheat', 'year'], best)
+        )
+        session.commit()
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+
+    if year_id is not None:
+        util.cache.bump_scores_version(year_id)
+    else:
+        for (year, ) in session.query(model.Year.id).all():
+            util.cache.bump_scores_version(year)
+
+    return result.rowcount
@@ -0,0 +1,150 @@
+import hashlib
+import os
+from collections import OrderedDict
+from secrets import token_hex
+from threading import Lock
+from time import time
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional, \
+    Tuple, TypeVar
+
+from db import on_primary
+from util.logger import get_log
+
+"""
+Sdilene verze cache mezi gunicorn workery.
+
+Kazdy worker si drzi vlastni cache v pameti, platnost cache je ale svazana s
+"verzi" ulozenou v souboru v CACHE_DIR. Zmena dat (napr. nove evaluation)
+verzi zvysi (bump()) a vsechny workery pri dalsim cteni zjisti, ze jejich
+cache je neplatna. Cteni verze je jen cteni maleho souboru, bez dotazu do
+databaze.
+"""
+
+CACHE_DIR = 'data/cache'
+
+T = TypeVar('T')
+
+
+def _version_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, key + '.version')
+
+
+def version(key: str) -> str:
+    """Vrati aktualni verzi klice 'key' ('0', pokud verze jeste neexistuje)"""
+    try:
+        with open(_version_path(key), 'r') as f:
+            return f.read().strip() or '0'
+    except FileNotFoundError:
+        return '0'
+
+
+def bump(key: str) -> None:
+    """Zneplatni vsechny cache svazane s klicem 'key' ve vsech workerech"""
+    path = _version_path(key)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            f.write(token_hex(8))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        get_log().error(f"Cannot bump cache version '{key}': {e}")
+
+
+def scores_version(year_id: int) -> str:
+    """Verze bodoveho hodnoceni rocniku 'year_id'"""
+    return version(f'scores-{year_id}')
+
+
+def bump_scores_version(year_id: Optional[int]) -> None:
+    """Volat po kazde zmene bodu v rocniku 'year_id' (evaluation, oprava,
+    zverejneni opraveni, deploy ulohy).
+    """
+    if year_id is not None:
+        bump(f'scores-{year_id}')
+
+
+class Snapshot(NamedTuple):
+    version: str
+    created: float
+    body: str
+    etag: str
+
+
+class SnapshotCache:
+    """
+    Cache serializovanych odpovedi v pameti workeru.
+    Snapshot je platny, dokud se nezmeni verze, se kterou byl ulozen, a
+    nejdele 'ttl' sekund (pojistka pro data, ktera verzi nezvysuji, napr.
+    zmena jmena uzivatele).
+    """
+
+    def __init__(self, max_entries: int = 64, ttl: float = 300) -> None:
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.__entries: "OrderedDict[Hashable, Snapshot]" = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key: Hashable, ver: str) -> Optional[Snapshot]:
+        with self.__lock:
+            snapshot = self.__entries.get(key)
+            if snapshot is None:
+                return None
+            if snapshot.version != ver or time() - snapshot.created > self.ttl:
+                del self.__entries[key]
+                return None
+            self.__entries.move_to_end(key)
+            return snapshot
+
+    def put(self, key: Hashable, ver: str, body: str) -> Snapshot:
+        snapshot = Snapshot(
+            version=ver,
+            created=time(),
+            body=body,
+            etag=hashlib.sha1(body.encode('utf-8')).hexdigest(),
+        )
+        with self.__lock:
+            self.__entries[key] = snapshot
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.max_entries:
+                self.__entries.popitem(last=False)
+        return snapshot
+
+    def clear(self) -> None:
+        with self.__lock:
+            self.__entries.clear()
+
+
+class VersionedCache:
+    """
+    Hodnoty spocitane v pameti workeru, platne dokud se nezmeni verze
+    'version_key'. Pro data, ktera se meni zridka a explicitne (deploy
+    ulohy), zmenu je nutne ohlasit volanim invalidate().
+    Vracene hodnoty jsou sdilene mezi pozadavky, nemodifikujte je.
+    Hodnoty se pocitaji z primarni databaze (db.on_primary).
+    """
+
+    def __init__(self, version_key: str) -> None:
+        self.version_key = version_key
+        self.__values: Dict[Hashable, Tuple[str, Any]] = {}
+        self.__lock = Lock()
+
+    def get(self, key: Hashable, compute: Callable[[], T]) -> T:
+        # Verzi cteme pred vypoctem: pokud se zmeni behem nej, ulozena
+        # hodnota bude pri dalsim cteni neplatna.
+        ver = version(self.version_key)
+        with self.__lock:
+            entry = self.__values.get(key)
+        if entry is not None and entry[0] == ver:
+            return entry[1]
+
+        with on_primary():
+            value = compute()
+        with self.__lock:
+            self.__values[key] = (ver, value)
+        return value
+
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__values.clear()
+        bump(self.version_key)
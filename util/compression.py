@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import os
+from typing import Optional
+
+import config
+from util.logger import get_log
+
+"""
+Gzip komprese odpovedi (viz app.py:GzipCompression).
+
+Odpovedi s telem (JSON) se komprimuji pri kazdem pozadavku. Staticke
+soubory z data/task-content se komprimuji jen jednou: komprimovana varianta
+se ulozi do PRECOMPRESSED_DIR pod jmenem odvozenym z cesty souboru a jeho
+mtime, takze zmena souboru (novy deploy ulohy) automaticky vede k nove
+variante. Stare varianty se pri vytvoreni nove smazou.
+
+Konfigurace (config.py, vse volitelne):
+ * GZIP_MIN_SIZE: mensi odpovedi se nekomprimuji (default 1024 B),
+ * GZIP_LEVEL: uroven komprese 1-9 (default 6).
+"""
+
+MIN_SIZE = getattr(config, 'GZIP_MIN_SIZE', 1024)
+LEVEL = getattr(config, 'GZIP_LEVEL', 6)
+
+# Staticke soubory, jejichz gzip varianty se cachuji na disku
+PRECOMPRESS_ROOT = os.path.abspath(os.path.join('data', 'task-content'))
+PRECOMPRESSED_DIR = os.path.join('data', 'cache', 'gzip')
+
+# Jiz komprimovane formaty (obrazky, zip, pdf, ...) nema smysl komprimovat
+COMPRESSIBLE_TYPES = (
+    'text/',
+    'application/json',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+)
+
+
+def accepts_gzip(accept_encoding: Optional[str]) -> bool:
+    """Vrati True, pokud hlavicka Accept-Encoding povoluje gzip
+    (respektuje 'gzip;q=0').
+    """
+    if not accept_encoding:
+        return False
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        if coding.strip().lower() not in ('gzip', '*'):
+            continue
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                return float(params[2:]) > 0
+            except ValueError:
+                return False
+        return True
+    return False
+
+
+def compressible(content_type: Optional[str]) -> bool:
+    return content_type is not None and \
+        content_type.lower().startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(data: bytes) -> bytes:
+    # mtime=0 -> stejny vstup dava stejny vystup (stabilni Content-Length)
+    return gzip.compress(data, compresslevel=LEVEL, mtime=0)
+
+
+def precompressed(path: str) -> Optional[str]:
+    """
+    Vrati cestu ke gzip variante statickeho souboru 'path' (pod
+    PRECOMPRESS_ROOT), pripadne ji vytvori. Vraci None, pokud soubor do
+    cache nepatri, je prilis maly nebo se kompresi nezmensi.
+    """
+    path = os.path.abspath(path)
+    if os.path.commonpath([path, PRECOMPRESS_ROOT]) != PRECOMPRESS_ROOT:
+        return None
+
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if stat.st_size < MIN_SIZE:
+        return None
+
+    prefix = hashlib.sha1(path.encode('utf-8')).hexdigest()
+    name = f"{prefix}-{stat.st_mtime_ns}-{stat.st_size}"
+    gz_path = os.path.join(PRECOMPRESSED_DIR, name + '.gz')
+    if os.path.isfile(gz_path):
+        return gz_path
+    if os.path.isfile(os.path.join(PRECOMPRESSED_DIR, name + '.skip')):
+        return None
+
+    try:
+        os.makedirs(PRECOMPRESSED_DIR, exist_ok=True)
+        with open(path, 'rb') as f:
+            data = compress(f.read())
+
+        for old in os.listdir(PRECOMPRESSED_DIR):
+            if old.startswith(prefix + '-'):
+                try:
+                    os.remove(os.path.join(PRECOMPRESSED_DIR, old))
+                except FileNotFoundError:
+                    pass
+
+        if len(data) >= stat.st_size:
+            # Nekomprimovatelny soubor, zapamatujeme si to
+            open(os.path.join(PRECOMPRESSED_DIR, name + '.skip'), 'w').close()
+            return None
+
+        # Atomicky zapis, soubor muze zaroven vytvaret vice workeru
+        tmp_path = f"{gz_path}.{os.getpid()}.{id(data)}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, gz_path)
+    except OSError as e:
+        get_log().error(f"Cannot precompress '{path}': {e}")
+        return None
+
+    return gz_path
@@ -43,17 +43,18 @@ class FileInfo(TypedDict):
     filename: str
 
 
-# \files je nepovinny seznam souboru pro zmenseni poctu SQL dotazu
+# \files je nepovinny slovnik {evaluation.id: [SubmittedFile]} pro zmenseni
+# poctu SQL dotazu
 def _corr_general_to_json(module: model.Module,
                           evaluation: model.Evaluation,
-                          files: Optional[List[model.SubmittedFile]] = None)\
+                          files: Optional[Dict[int, List[model.SubmittedFile]]] = None)\
         -> Dict[str, List[FileInfo]]:
     if files is None:
         files = session.query(model.SubmittedFile).\
             join(model.Evaluation,
                  model.SubmittedFile.evaluation == evaluation.id).all()
     else:
-        files = [smbfl for smbfl in files if smbfl.evaluation == evaluation.id]
+        files = files.get(evaluation.id, [])
 
     return {
         'files': [
@@ -77,10 +78,10 @@ class CorrInfo(TypedDict):
     text: Dict
 
 
-# \files je seznam souboru pro souborovy modul
+# \files je {evaluation.id: [SubmittedFile]} pro souborovy modul
 def corr_eval_to_json(module: model.Module,
                       evaluation: model.Evaluation,
-                      files: Optional[List[model.SubmittedFile]] = None)\
+                      files: Optional[Dict[int, List[model.SubmittedFile]]] = None)\
         -> CorrInfo:
     res = {
         'eval_id': evaluation.id,
@@ -114,10 +115,10 @@ class ModuleCorr(TypedDict):
 # U modulu se zobrazuje jen jedno evaluation:
 #  Pokud to ma byt nejadekvatnejsi evaluation, je \evl=None.
 #  Pokud to ma byt specificke evaluation, je toto evalustion ulozeno v \evl
-# \files je seznam souboru pro souborovy modul
+# \files je {evaluation.id: [SubmittedFile]} pro souborovy modul
 def _corr_module_to_json(evals: List[model.Evaluation], module: model.Module,
                          evl: Optional[model.Evaluation] = None,
-                         files: Optional[List[model.SubmittedFile]] = None)\
+                         files: Optional[Dict[int, List[model.SubmittedFile]]] = None)\
         -> ModuleCorr:
     if evl is None:
         # Ano, v Pythonu neexistuje max() pres dva klice
@@ -145,7 +146,7 @@ class CorrJson(TypedDict):
 # \evals je [Evaluation]
 # \achievements je [Ahievement.id]
 # \corrected je Bool
-# \files je seznam souboru
+# \files je {evaluation.id: [SubmittedFile]}
 def to_json(modules: List[Tuple[model.Evaluation,
                                 model.Module,
                                 Optional[model.Evaluation]]],
@@ -154,7 +155,8 @@ def to_json(modules: List[Tuple[model.Evaluation,
             thread_id: Optional[int] = None,
             achievements: Optional[List[int]] = None,
             corrected: Optional[bool] = None,
-            files: Optional[List[model.SubmittedFile]] = None) -> CorrJson:
+            files: Optional[Dict[int, List[model.SubmittedFile]]] = None)\
+        -> CorrJson:
     user_id = evals[0].user
 
     if thread_id is None:
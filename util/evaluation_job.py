@@ -0,0 +1,437 @@
+import datetime
+import json
+import multiprocessing
+import os
+import socket
+import traceback
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from threading import Event, Lock, Thread
+from uuid import uuid4
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+from sqlalchemy import and_, or_, update
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+import config
+import model
+import util
+from db import engine, session
+from util.logger import get_log
+
+"""
+Opravovani odevzdaneho kodu mimo HTTP pozadavek.
+
+ModuleSubmit s ?async=1 (nebo ASYNC_EVALUATION = True v config.py) jen
+vytvori Evaluation a EvaluationJob a vrati id ulohy (= id evaluation).
+Opraveni (util.programming.evaluate) bezi v procesech 'executor' (pocet
+EVAL_EXECUTOR_PROCESSES na gunicorn worker, default 2), stav a vysledek
+vraci endpoint /evaluations/{id}/status.
+
+Procesy se spousteji metodou 'spawn' (ne fork), aby nezdedily spojeni do
+databaze a vlakna gunicorn workeru.
+
+S EVAL_REMOTE_WORKERS = True web ulohy jen uklada do tabulky
+evaluation_jobs a zpracovavaji je samostatne workery (worker.py, i na
+jinych strojich). Uloha se zabira s leasem na LEASE_TIME sekund, ktery
+worker behem opravovani prodluzuje (Heartbeat). Ulohu spadleho workeru
+(lease vyprsel) prevezme jiny worker, nejvyse MAX_ATTEMPTS pokusu.
+"""
+
+ASYNC_DEFAULT = getattr(config, 'ASYNC_EVALUATION', False)
+EXECUTOR_PROCESSES = getattr(config, 'EVAL_EXECUTOR_PROCESSES', 2)
+REMOTE_WORKERS = getattr(config, 'EVAL_REMOTE_WORKERS', False)
+# Lease zabrane ulohy [s], worker ho prodluzuje kazdych HEARTBEAT_INTERVAL s
+LEASE_TIME = getattr(config, 'EVAL_LEASE_TIME', 60)
+HEARTBEAT_INTERVAL = getattr(config, 'EVAL_HEARTBEAT_INTERVAL', 15)
+MAX_ATTEMPTS = getattr(config, 'EVAL_MAX_ATTEMPTS', 3)
+# Cekajici uloha starsi nez STALE_TIMEOUT [s] se preda znovu (recover())
+STALE_TIMEOUT = getattr(config, 'EVAL_STALE_TIMEOUT', 300)
+
+ERROR_MESSAGE = ('Nastala chyba při vykonávání kódu, zkus to prosím znovu '
+                 'později a v případě přetrvávající chyby kontaktuj '
+                 'organizátora')
+
+
+def run_submission(module: model.Module, user_id: int, evaluation_id: int,
+                   code: str) -> Tuple[Dict, 'util.programming.Reporter']:
+    """Opravi kod 'code' odevzdany do 'evaluation_id'. Do databaze nic
+    nezapisuje (viz store_result). Vraci vysledek a report opraveni."""
+    reporter = util.programming.Reporter(max_size=50*1000)  # prevent database overflow
+
+    try:
+        result = util.programming.evaluate(
+            module.task, module, user_id, code, evaluation_id, reporter
+        )
+    except util.programming.ENoFreeBox:
+        result = {
+            'result': 'error',
+            'message': ('Přesáhnut maximální počet souběžně běžících '
+                        'opravení, zkuste to za chvíli.')
+        }
+    except Exception:
+        reporter += 'Zachycena chyba:\n'
+        reporter += traceback.format_exc()
+        result = {
+            'result': 'error',
+            'message': ERROR_MESSAGE
+        }
+
+    return result, reporter
+
+
+def store_result(evaluation: model.Evaluation, result: Dict,
+                 reporter: 'util.programming.Reporter') -> None:
+    """Zapise body a report do 'evaluation' (bez commitu)"""
+    evaluation.points = result['score'] if 'score' in result else 0
+    evaluation.ok = (result['result'] == 'ok')
+    evaluation.full_report += (str(datetime.datetime.now()) + " : " +
+                               reporter.report_truncated + '\n')
+
+
+def apply_result(module: model.Module, user: 'util.UserInfo', result: Dict,
+                 reporter: 'util.programming.Reporter') -> None:
+    """Prepocita nejlepsi skore a provede akce opravovaciho skriptu. Volat
+    az po commitu store_result. Body uz jsou ulozene, selhani akce se proto
+    jen zaloguje."""
+    util.best_score.update(user.id, module.id)
+
+    for action in result.get('actions', []):
+        reporter += "Performing %s...\n" % (action)
+        try:
+            util.module.perform_action(module, user, action)
+        except Exception:
+            get_log().error(f"Action '{action}' of module {module.id} for "
+                            f"user {user.id} failed:\n"
+                            f"{traceback.format_exc()}")
+            reporter += "Action failed:\n" + traceback.format_exc()
+
+
+def _response(user: 'util.UserInfo', result: Dict,
+              reporter: 'util.programming.Reporter') -> Dict:
+    if user.is_org():
+        result['report'] = reporter.report_truncated
+    return result
+
+
+def evaluate_submission(module: model.Module, user: 'util.UserInfo',
+                        evaluation: model.Evaluation, code: str) -> Dict:
+    """Opravi kod 'code' odevzdany do 'evaluation', ulozi body a report a
+    provede akce opravovaciho skriptu. Vraci odpoved pro uzivatele."""
+    result, reporter = run_submission(module, user.id, evaluation.id, code)
+    store_result(evaluation, result, reporter)
+    session.commit()
+    apply_result(module, user, result, reporter)
+    return _response(user, result, reporter)
+
+
+def worker_id() -> str:
+    """Identifikace procesu zpracovavajiciho ulohy"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class Claim(NamedTuple):
+    evaluation_id: int
+    # EvaluationJob.worker: jedinecny pro kazde zabrani ulohy, i vlakna
+    # jednoho procesu (a opakovane zabrani tymz vlaknem) se tak lisi
+    lease: str
+
+
+def claim(evaluation_id: Optional[int] = None) -> Optional[Claim]:
+    """
+    Zabere nejstarsi cekajici ulohu nebo ulohu, jejiz lease vyprsel (worker
+    spadl), pripadne jen ulohu 'evaluation_id'. Radky zamcene jinymi
+    workery se preskakuji (SELECT ... FOR UPDATE SKIP LOCKED), kazdou ulohu
+    tedy zabere jen jeden worker. Ulohy, ktere uz MAX_ATTEMPTS krat
+    nedobehly, se oznaci jako chybne. Vraci zabranou ulohu nebo None.
+    """
+    while True:
+        now = datetime.datetime.utcnow()
+        query = session.query(model.EvaluationJob).filter(or_(
+            model.EvaluationJob.status == 'queued',
+            and_(model.EvaluationJob.status == 'running',
+                 model.EvaluationJob.lease_expires < now)
+        ))
+        if evaluation_id is not None:
+            query = query.filter(
+                model.EvaluationJob.evaluation == evaluation_id)
+        job = query.order_by(model.EvaluationJob.created).\
+            with_for_update(skip_locked=True).first()
+
+        if job is None:
+            session.commit()
+            return None
+
+        if job.attempts >= MAX_ATTEMPTS:
+            get_log().error(f"Evaluation job {job.evaluation} failed "
+                            f"{job.attempts} times, giving up")
+            _set_result(job, 'error', {
+                'result': 'error',
+                'message': ERROR_MESSAGE
+            })
+            session.commit()
+            continue
+
+        lease = f"{worker_id()}:{uuid4().hex}"
+        job.status = 'running'
+        job.worker = lease
+        job.attempts += 1
+        job.started = now
+        job.lease_expires = now + datetime.timedelta(seconds=LEASE_TIME)
+        session.commit()
+        return Claim(job.evaluation, lease)
+
+
+class Heartbeat:
+    """
+    Vlakno prodluzujici lease 'claim' kazdych HEARTBEAT_INTERVAL sekund
+    (vlastnim spojenim do databaze). Pokud ulohu mezitim prevzal jiny
+    worker, nastavi 'lost'.
+    """
+
+    def __init__(self, claim: Claim) -> None:
+        self.evaluation_id = claim.evaluation_id
+        self.lease = claim.lease
+        self.lost = False
+        self.__stop = Event()
+        self.__thread = Thread(target=self.__run, daemon=True,
+                               name=f'heartbeat-{self.evaluation_id}')
+
+    def __enter__(self) -> 'Heartbeat':
+        self.__thread.start()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.__stop.set()
+        self.__thread.join()
+
+    def __run(self) -> None:
+        while not self.__stop.wait(HEARTBEAT_INTERVAL):
+            try:
+                with Session(engine) as heartbeat_session:
+                    updated = heartbeat_session.execute(
+                        update(model.EvaluationJob).where(
+                            model.EvaluationJob.evaluation ==
+                            self.evaluation_id,
+                            model.EvaluationJob.worker == self.lease,
+                            model.EvaluationJob.status == 'running',
+                        ).values(lease_expires=datetime.datetime.utcnow() +
+                                 datetime.timedelta(seconds=LEASE_TIME))
+                    ).rowcount
+                    heartbeat_session.commit()
+            except SQLAlchemyError as e:
+                # Lease zatim nevyprsel, zkusi se to znovu
+                get_log().error(f"Heartbeat of evaluation job "
+                                f"{self.evaluation_id} failed: {e}")
+                continue
+            if updated == 0:
+                self.lost = True
+                return
+
+
+def run(claim: Claim) -> None:
+    """
+    Opravi zabranou ulohu (viz claim()). Body, report a vysledek ulohy se
+    zapisuji v jedne transakci se zamcenym radkem ulohy a jen pokud ulohu
+    mezitim neprevzal jiny worker (lease 'claim'), nejlepsi skore a akce
+    skriptu se provedou az po commitu. Jinak se vysledek zahodi.
+    """
+    evaluation_id = claim.evaluation_id
+    reporter = None
+    with Heartbeat(claim) as heartbeat:
+        try:
+            evaluation = session.query(model.Evaluation).get(evaluation_id)
+            module = session.query(model.Module).get(evaluation.module)
+            user = util.UserInfo(
+                session.query(model.User).get(evaluation.user))
+            code = session.query(model.SubmittedCode).\
+                filter(model.SubmittedCode.evaluation == evaluation_id).\
+                order_by(model.SubmittedCode.id.desc()).first()
+            # Behem opravovani nedrzime transakci
+            session.commit()
+
+            result, reporter = run_submission(module, user.id, evaluation_id,
+                                              code.code)
+            status = 'done'
+        except SQLAlchemyError:
+            session.rollback()
+            raise
+        except Exception:
+            get_log().error(f"Evaluation job {evaluation_id} failed:\n"
+                            f"{traceback.format_exc()}")
+            session.rollback()
+            result = {
+                'result': 'error',
+                'message': ERROR_MESSAGE
+            }
+            status = 'error'
+
+    job = session.query(model.EvaluationJob).\
+        filter(model.EvaluationJob.evaluation == evaluation_id,
+               model.EvaluationJob.worker == claim.lease,
+               model.EvaluationJob.status == 'running').\
+        with_for_update().first()
+    if job is None:
+        # Lease vyprsel a ulohu prevzal jiny worker
+        get_log().warning(f"Evaluation job {evaluation_id} lost its lease"
+                          f"{' (heartbeat)' if heartbeat.lost else ''}, "
+                          f"result discarded")
+        session.rollback()
+        return
+
+    if reporter is not None:
+        store_result(session.query(model.Evaluation).get(evaluation_id),
+                     result, reporter)
+        result = _response(user, result, reporter)
+    _set_result(job, status, result)
+    session.commit()
+
+    if reporter is not None:
+        apply_result(module, user, result, reporter)
+
+
+def _set_result(job: model.EvaluationJob, status: str, result: Dict) -> None:
+    job.status = status
+    job.result = json.dumps(result)
+    job.finished = datetime.datetime.utcnow()
+    job.lease_expires = None
+
+
+def process(evaluation_id: int) -> None:
+    """Zpracuje ulohu 'evaluation_id' (bezi v procesu executoru)"""
+    try:
+        claimed = claim(evaluation_id)
+        if claimed is not None:
+            run(claimed)
+    except SQLAlchemyError:
+        session.rollback()
+        raise
+    finally:
+        session.remove()
+
+
+def status_to_json(job: model.EvaluationJob) -> Dict:
+    result = {
+        'id': job.evaluation,
+        'status': job.status,
+        'created': job.created.isoformat() if job.created else None,
+        'started': job.started.isoformat() if job.started else None,
+        'finished': job.finished.isoformat() if job.finished else None,
+    }
+
+    if job.status == 'queued':
+        result['position'] = session.query(model.EvaluationJob).\
+            filter(model.EvaluationJob.status == 'queued',
+                   model.EvaluationJob.created < job.created).count()
+    if job.result is not None:
+        result['result'] = json.loads(job.result)
+
+    return result
+
+
+class JobExecutor:
+    """ProcessPoolExecutor workeru, vytvari se az pri prvni uloze v kazdem
+    procesu."""
+
+    def __init__(self, processes: int) -> None:
+        self.processes = processes
+        self.__lock = Lock()
+        self.__pid: Optional[int] = None
+        self.__executor: Optional[ProcessPoolExecutor] = None
+        # Ulohy predane executoru tohoto procesu, ktere jeste nedobehly
+        self.__pending: Set[int] = set()
+
+    def submit(self, evaluation_id: int) -> Future:
+        with self.__lock:
+            if self.__pid != os.getpid():
+                self.__pending = set()
+                self.__start()
+            self.__pending.add(evaluation_id)
+            try:
+                future = self.__executor.submit(process, evaluation_id)
+            except BrokenProcessPool:
+                # Nektery proces executoru spadl, executor je nepouzitelny
+                self.__start()
+                future = self.__executor.submit(process, evaluation_id)
+        future.add_done_callback(lambda f: self.__done(evaluation_id, f))
+        return future
+
+    def pending(self, evaluation_id: int) -> bool:
+        with self.__lock:
+            return (self.__pid == os.getpid() and
+                    evaluation_id in self.__pending)
+
+    def __done(self, evaluation_id: int, future: Future) -> None:
+        with self.__lock:
+            self.__pending.discard(evaluation_id)
+        if future.exception() is not None:
+            _crashed(evaluation_id, future.exception())
+
+    def __start(self) -> None:
+        self.__executor = ProcessPoolExecutor(
+            max_workers=self.processes,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+        self.__pid = os.getpid()
+
+
+def _crashed(evaluation_id: int, e: BaseException) -> None:
+    """Uloha nedobehla (spadl proces executoru), oznaci ji jako chybnou"""
+    get_log().error(f"Evaluation job {evaluation_id} crashed: {e}")
+    try:
+        job = session.query(model.EvaluationJob).get(evaluation_id)
+        if job is not None and job.status in ('queued', 'running'):
+            _set_result(job, 'error', {
+                'result': 'error',
+                'message': ERROR_MESSAGE
+            })
+            session.commit()
+    except SQLAlchemyError as err:
+        session.rollback()
+        get_log().error(f"Cannot mark evaluation job {evaluation_id}: {err}")
+    finally:
+        session.remove()
+
+
+executor = JobExecutor(EXECUTOR_PROCESSES)
+
+
+def recover(job: model.EvaluationJob) -> bool:
+    """
+    Preda znovu executoru tohoto workeru ulohu, kterou nikdo nezpracovava:
+    cekajici dele nez STALE_TIMEOUT sekund (gunicorn worker, jehoz executoru
+    byla predana, skoncil drive, nez ji zabral) nebo beziciho s vyprselym
+    leasem (proces executoru spadl). Zabrat ji muze jen jeden proces
+    (claim), opakovane predani tedy nevadi. Vraci True, pokud byla uloha
+    predana.
+    """
+    if REMOTE_WORKERS or executor.pending(job.evaluation):
+        # Ulohy si zaberou workery (worker.py) samy
+        return False
+
+    now = datetime.datetime.utcnow()
+    stale = (
+        (job.status == 'queued' and
+         job.created < now - datetime.timedelta(seconds=STALE_TIMEOUT)) or
+        (job.status == 'running' and job.lease_expires is not None and
+         job.lease_expires < now)
+    )
+    if not stale:
+        return False
+
+    get_log().warning(f"Evaluation job {job.evaluation} ({job.status}) is "
+                      f"not being processed, resubmitting")
+    executor.submit(job.evaluation)
+    return True
+
+
+def enqueue(evaluation: model.Evaluation) -> model.EvaluationJob:
+    """Vytvori ulohu pro 'evaluation' (odevzdany kod uz musi byt ulozen) a
+    preda ji executoru (s EVAL_REMOTE_WORKERS si ji zabere worker.py)."""
+    job = model.EvaluationJob(evaluation=evaluation.id, status='queued')
+    session.add(job)
+    session.commit()
+    if not REMOTE_WORKERS:
+        executor.submit(evaluation.id)
+    return job
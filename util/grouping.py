@@ -0,0 +1,39 @@
+from collections import defaultdict
+from typing import Callable, Dict, Hashable, Iterable, List, Optional, TypeVar
+
+"""
+Seskupovani vysledku SQL dotazu v Pythonu.
+
+Endpointy typu vysledkovka (Users, Corrections, profil) nejprve polozi par
+velkych dotazu a vysledky pak rozdeluji podle uzivatele (ulohy, ...).
+Misto filtrovani celeho seznamu pro kazdeho uzivatele (O(uzivatele * radky))
+se radky jednim pruchodem rozdeli do slovniku klic -> [hodnoty].
+"""
+
+T = TypeVar('T')
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+def group_by(rows: Iterable[T], key: Callable[[T], K],
+             value: Optional[Callable[[T], V]] = None) -> Dict[K, List[V]]:
+    """Rozdeli 'rows' do slovniku { key(row): [value(row), ...] } jednim
+    pruchodem. Poradi radku v ramci skupiny je zachovano.
+    Pro chybejici klic pouzivejte .get(klic, []).
+    """
+    groups: Dict[K, List[V]] = defaultdict(list)
+    if value is None:
+        for row in rows:
+            groups[key(row)].append(row)
+    else:
+        for row in rows:
+            groups[key(row)].append(value(row))
+    return dict(groups)
+
+
+def index_by(rows: Iterable[T], key: Callable[[T], K]) -> Dict[K, T]:
+    """Vrati { key(row): row }, pri duplicitnim klici vyhrava prvni radek."""
+    index: Dict[K, T] = {}
+    for row in rows:
+        index.setdefault(key(row), row)
+    return index
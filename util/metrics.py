@@ -0,0 +1,393 @@
+import fcntl
+import json
+import os
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter, time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.engine import Engine
+
+import util
+from util.logger import get_log
+
+"""
+Metriky backendu ve formatu Prometheus (text exposition format), viz
+endpoint /admin/metrics.
+
+Kazdy gunicorn worker si metriky pocita v pameti (module-level 'registry')
+a prubezne (nejvyse jednou za FLUSH_INTERVAL sekund, pri konci pozadavku)
+je uklada do souboru METRICS_DIR/<pid>.json. Endpoint pak secte soubory
+vsech workeru:
+ * countery a histogramy se scitaji ze vsech souboru, i od ukoncenych
+   workeru (countery nesmi klesat), soubory ukoncenych workeru se pri
+   cteni slouci do RETIRED_FILE a smazou,
+ * gauge se scitaji jen od zijicich workeru.
+Hodnoty ostatnich workeru tedy mohou byt az FLUSH_INTERVAL sekund stare.
+
+Sandboxy (/tmp/box) jsou sdilene mezi workery, jejich pocet se zjistuje az
+pri cteni metrik.
+"""
+
+METRICS_DIR = 'data/metrics'
+# Soucet counteru a histogramu ukoncenych workeru
+RETIRED_FILE = 'retired.json'
+FLUSH_INTERVAL = 5
+
+# Hranice bucketu histogramu v sekundach
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+EXEC_WAIT_BUCKETS = (0.0, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0)
+
+# Serializovatelny klic serie: tuple hodnot labelu
+Labels = Tuple[str, ...]
+
+
+class Histogram:
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = buckets
+        # counts[i] = pocet pozorovani v (buckets[i-1], buckets[i]],
+        # posledni prvek = pozorovani nad nejvyssi hranici
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def to_json(self) -> Dict:
+        return {'counts': self.counts, 'sum': self.sum}
+
+
+class MetricsRegistry:
+    """Metriky jednoho workeru (procesu)"""
+
+    def __init__(self) -> None:
+        self.__lock = Lock()
+        self.__flush_lock = Lock()
+        self.__last_flush = 0.0
+        self.requests: Dict[Labels, int] = {}
+        self.latency: Dict[Labels, Histogram] = {}
+        self.pool_wait: Dict[Labels, Histogram] = {}
+        self.exec_wait = Histogram(EXEC_WAIT_BUCKETS)
+
+    def observe_request(self, route: str, method: str, status: str,
+                        duration: float) -> None:
+        with self.__lock:
+            key = (route, method, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            key = (route, method)
+            if key not in self.latency:
+                self.latency[key] = Histogram(LATENCY_BUCKETS)
+            self.latency[key].observe(duration)
+        self.flush()
+
+    def observe_pool_wait(self, engine: str, duration: float) -> None:
+        with self.__lock:
+            key = (engine,)
+            if key not in self.pool_wait:
+                self.pool_wait[key] = Histogram(POOL_WAIT_BUCKETS)
+            self.pool_wait[key].observe(duration)
+
+    def observe_exec_wait(self, duration: float) -> None:
+        with self.__lock:
+            self.exec_wait.observe(duration)
+
+    def snapshot(self) -> Dict:
+        pool = util.programming.box_pool.stats()
+        scheduler = util.programming.scheduler.stats()
+        with self.__lock:
+            counters = {
+                'ksi_http_requests_total': [
+                    [list(k), v] for k, v in self.requests.items()
+                ],
+                'ksi_sandbox_pool_leases_total': [
+                    [['hit'], pool['hits']], [['miss'], pool['misses']]
+                ],
+                'ksi_sandbox_pool_resets_total': [[[], pool['resets']]],
+                'ksi_sandbox_pool_reset_seconds_total': [
+                    [[], pool['reset_time']]
+                ],
+                'ksi_exec_queue_failures_total': [
+                    [['timeout'], scheduler['timeouts']],
+                    [['full'], scheduler['rejected']],
+                ],
+            }
+            histograms = {
+                'ksi_http_request_duration_seconds': [
+                    [list(k), h.to_json()] for k, h in self.latency.items()
+                ],
+                'ksi_db_pool_checkout_seconds': [
+                    [list(k), h.to_json()] for k, h in self.pool_wait.items()
+                ],
+                'ksi_exec_queue_wait_seconds': [
+                    [[], self.exec_wait.to_json()]
+                ],
+            }
+        return {
+            'pid': os.getpid(),
+            'counters': counters,
+            'histograms': histograms,
+            'gauges': {
+                'ksi_mail_queue_depth': [[[], util.mail.emailQueue.qsize()]],
+                'ksi_sandbox_pool_idle': [[[], pool['idle']]],
+                'ksi_exec_queue_depth': [[[], scheduler['depth']]],
+                'ksi_db_pool_checked_out': [
+                    [[name], engine.pool.checkedout()]
+                    for name, engine in _engines.items()
+                    if hasattr(engine.pool, 'checkedout')
+                ],
+            },
+        }
+
+    def flush(self, force: bool = False) -> None:
+        """Ulozi metriky workeru do METRICS_DIR (nejvyse jednou za
+        FLUSH_INTERVAL sekund, pokud neni 'force')."""
+        if not force and time() - self.__last_flush < FLUSH_INTERVAL:
+            return
+        # Soubor workeru zapisuje vzdy jen jedno vlakno
+        if not self.__flush_lock.acquire(blocking=force):
+            return
+        try:
+            self.__last_flush = time()
+            path = os.path.join(METRICS_DIR, f"{os.getpid()}.json")
+            tmp_path = f"{path}.tmp"
+            os.makedirs(METRICS_DIR, exist_ok=True)
+            with open(tmp_path, 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            get_log().error(f"Cannot store metrics: {e}")
+        finally:
+            self.__flush_lock.release()
+
+
+registry = MetricsRegistry()
+_engines: Dict[str, Engine] = {}
+
+
+def install_pool(engine: Optional[Engine], name: str) -> None:
+    """Meri cas ziskani spojeni z poolu enginu 'engine' (vcetne cekani na
+    volne spojeni a pool_pre_ping)."""
+    if engine is None or name in _engines:
+        return
+    _engines[name] = engine
+    pool = engine.pool
+    connect = pool.connect
+
+    def timed_connect():
+        start = perf_counter()
+        try:
+            return connect()
+        finally:
+            registry.observe_pool_wait(name, perf_counter() - start)
+
+    pool.connect = timed_connect
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _load_workers() -> List[Tuple[str, Dict]]:
+    snapshots = []
+    try:
+        names = os.listdir(METRICS_DIR)
+    except FileNotFoundError:
+        return snapshots
+    for name in names:
+        if not name.endswith('.json') or name == RETIRED_FILE:
+            continue
+        try:
+            with open(os.path.join(METRICS_DIR, name), 'r') as f:
+                snapshots.append((name, json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _load_retired() -> Dict:
+    try:
+        with open(os.path.join(METRICS_DIR, RETIRED_FILE), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _retire(names: List[str]) -> None:
+    """Pricte countery a histogramy ukoncenych workeru 'names' do
+    RETIRED_FILE a jejich soubory smaze (countery tak neklesaji a adresar
+    neroste s kazdym restartem workeru)."""
+    with open(os.path.join(METRICS_DIR, RETIRED_FILE + '.lock'), 'w') as lock:
+        # Soubory muze zaroven slucovat i jiny worker
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            values = _empty_values()
+            _merge(values, _load_retired(), ('counters', 'histograms'))
+            retired = []
+            for name in names:
+                path = os.path.join(METRICS_DIR, name)
+                try:
+                    with open(path, 'r') as f:
+                        snapshot = json.load(f)
+                except FileNotFoundError:
+                    continue
+                except ValueError:
+                    snapshot = {}
+                _merge(values, snapshot, ('counters', 'histograms'))
+                retired.append(path)
+            if not retired:
+                return
+
+            result: Dict[str, Dict] = {'counters': {}, 'histograms': {}}
+            for name, series in values.items():
+                kind = METRICS[name][0]
+                if kind == 'gauge':
+                    continue
+                result[kind + 's'][name] = [
+                    [list(labels), value] for labels, value in series.items()
+                ]
+            path = os.path.join(METRICS_DIR, RETIRED_FILE)
+            with open(f"{path}.tmp", 'w') as f:
+                json.dump(result, f)
+            os.replace(f"{path}.tmp", path)
+            for path in retired:
+                os.remove(path)
+        except OSError as e:
+            get_log().error(f"Cannot retire metrics of dead workers: {e}")
+
+
+def _label_str(names: Tuple[str, ...], values: List[str],
+               extra: str = '') -> str:
+    pairs = [
+        '{}="{}"'.format(n, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for n, v in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+# (typ, popis, jmena labelu, hranice bucketu)
+METRICS = {
+    'ksi_http_requests_total': (
+        'counter', 'HTTP requests by route, method and status',
+        ('route', 'method', 'status'), None),
+    'ksi_http_request_duration_seconds': (
+        'histogram', 'HTTP request latency by route and method',
+        ('route', 'method'), LATENCY_BUCKETS),
+    'ksi_db_pool_checkout_seconds': (
+        'histogram', 'Time to check out a connection from the DB pool',
+        ('engine',), POOL_WAIT_BUCKETS),
+    'ksi_db_pool_checked_out': (
+        'gauge', 'DB connections currently checked out', ('engine',), None),
+    'ksi_mail_queue_depth': (
+        'gauge', 'E-mails waiting in util.mail.emailQueue', (), None),
+    'ksi_sandbox_pool_leases_total': (
+        'counter', 'Sandbox leases served from the pool (hit) or '
+        'initialized on demand (miss)', ('result',), None),
+    'ksi_sandbox_pool_resets_total': (
+        'counter', 'Sandboxes reset in the background', (), None),
+    'ksi_sandbox_pool_reset_seconds_total': (
+        'counter', 'Time spent resetting sandboxes', (), None),
+    'ksi_sandbox_pool_idle': (
+        'gauge', 'Initialized sandboxes waiting in the pool', (), None),
+    'ksi_exec_queue_depth': (
+        'gauge', 'Code executions waiting for a free sandbox', (), None),
+    'ksi_exec_queue_wait_seconds': (
+        'histogram', 'Time code executions waited for a sandbox', (),
+        EXEC_WAIT_BUCKETS),
+    'ksi_exec_queue_failures_total': (
+        'counter', 'Code executions not started (wait timeout, full queue)',
+        ('reason',), None),
+}
+
+
+def _empty_values() -> Dict[str, Dict[Labels, object]]:
+    return {name: {} for name in METRICS}
+
+
+def _merge(values: Dict[str, Dict[Labels, object]], snapshot: Dict,
+           kinds: Tuple[str, ...]) -> None:
+    """Pricte serie 'kinds' ze 'snapshot' (soubor workeru) do 'values'"""
+    for kind in kinds:
+        for name, series in snapshot.get(kind, {}).items():
+            if name not in values:
+                continue
+            for labels, value in series:
+                key = tuple(labels)
+                if kind == 'histograms':
+                    if key not in values[name]:
+                        values[name][key] = {
+                            'counts': [0] * len(value['counts']),
+                            'sum': 0.0
+                        }
+                    agg = values[name][key]
+                    if len(agg['counts']) != len(value['counts']):
+                        # Worker se starsimi hranicemi bucketu
+                        continue
+                    agg['counts'] = [
+                        a + b for a, b in zip(agg['counts'], value['counts'])
+                    ]
+                    agg['sum'] += value['sum']
+                else:
+                    values[name][key] = values[name].get(key, 0) + value
+
+
+def render() -> str:
+    """Metriky vsech workeru v textovem formatu Prometheus"""
+    registry.flush(force=True)
+
+    workers = _load_workers()
+    dead = [name for name, worker in workers
+            if not _alive(worker.get('pid', 0))]
+    if dead:
+        _retire(dead)
+        workers = [(name, worker) for name, worker in workers
+                   if name not in dead]
+
+    values = _empty_values()
+    _merge(values, _load_retired(), ('counters', 'histograms'))
+    for _, worker in workers:
+        _merge(values, worker, ('counters', 'histograms', 'gauges'))
+
+    lines = []
+    for name, (kind, help_, label_names, buckets) in METRICS.items():
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(values[name].items()):
+            if kind != 'histogram':
+                lines.append(f"{name}{_label_str(label_names, labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + (float('inf'),),
+                                    value['counts']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                le_label = 'le="' + le + '"'
+                lines.append(
+                    f"{name}_bucket"
+                    f"{_label_str(label_names, labels, le_label)} "
+                    f"{cumulative}"
+                )
+            lines.append(f"{name}_sum{_label_str(label_names, labels)} "
+                         f"{value['sum']}")
+            lines.append(f"{name}_count{_label_str(label_names, labels)} "
+                         f"{cumulative}")
+
+    lines.append("# HELP ksi_sandbox_boxes_in_use Sandbox boxes in use")
+    lines.append("# TYPE ksi_sandbox_boxes_in_use gauge")
+    lines.append(f"ksi_sandbox_boxes_in_use {util.programming.boxes_in_use()}")
+    lines.append("# HELP ksi_sandbox_boxes_max MAX_CONCURRENT_EXEC")
+    lines.append("# TYPE ksi_sandbox_boxes_max gauge")
+    lines.append(
+        f"ksi_sandbox_boxes_max {util.programming.MAX_CONCURRENT_EXEC}")
+
+    return '\n'.join(lines) + '\n'
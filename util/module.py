@@ -2,11 +2,12 @@ import os
 import datetime
 import json
 import shutil
-from sqlalchemy import func, desc
+from sqlalchemy import and_, func, desc
 from sqlalchemy.exc import SQLAlchemyError
 import copy
 import subprocess
 import traceback
+from typing import Any, Dict, List, NamedTuple, Optional
 
 from db import session
 from model.module import ModuleType
@@ -32,44 +33,134 @@ def existing_evaluation(module_id, user_id):
     return [r for (r, ) in results]
 
 
-def to_json(module, user_id):
-    if module.custom and user_id is not None:
-        _module = _load_custom(module, user_id)
-    else:
-        _module = module
+class UserModulesData(NamedTuple):
+    """Data resitele potrebna pro to_json() vsech modulu jedne ulohy"""
+    # { module_id : nejlepsi evaluation (id, module, ok, time, public) }
+    best: Dict[int, Any]
+    # { module_id : posledni kod programovaciho modulu }
+    last_code: Dict[int, 'util.programming.LastCode']
+    # { module_id : [(id, path) odevzdanych souboru] }
+    files: Dict[int, List[Any]]
 
-    module_json = _info_to_json(_module)
 
-    # Ziskame nejlepsi evaluation.
-    best = session.query(
-        model.Evaluation,
-        model.Task
+def load_user_data(modules: List[model.Module],
+                   user_id: Optional[int]) -> UserModulesData:
+    """Nacte data resitele 'user_id' pro vsechny moduly 'modules' pevnym
+    poctem SQL dotazu (nezavisle na poctu modulu).
+    """
+    data = UserModulesData(best={}, last_code={}, files={})
+    if user_id is None or not modules:
+        return data
+
+    module_ids = [module.id for module in modules]
+    prog_ids = [module.id for module in modules
+                if module.type == ModuleType.PROGRAMMING]
+    general_ids = [module.id for module in modules
+                   if module.type == ModuleType.GENERAL]
+
+    # Nejlepsi evaluation = prvni v poradi pro kazdy modul. Nenacitame cele
+    # evaluation (full_report muze byt velky), jen potrebne sloupce.
+    evaluations = session.query(
+        model.Evaluation.id.label('id'),
+        model.Evaluation.module.label('module'),
+        model.Evaluation.ok.label('ok'),
+        model.Evaluation.time.label('time'),
+        model.Task.evaluation_public.label('evaluation_public'),
     ).\
-        filter(model.Evaluation.user == user_id,
-               model.Evaluation.module == module.id).\
         join(model.Module, model.Module.id == model.Evaluation.module).\
         join(model.Task, model.Task.id == model.Module.task).\
-        order_by(desc(model.Evaluation.ok), desc(model.Evaluation.points),
+        filter(model.Evaluation.user == user_id,
+               model.Evaluation.module.in_(module_ids)).\
+        order_by(model.Evaluation.module, desc(model.Evaluation.ok),
+                 desc(model.Evaluation.points),
                  desc(model.Evaluation.time)).\
-        first()
+        all()
+    data.best.update(util.grouping.index_by(evaluations,
+                                            lambda ev: ev.module))
+
+    if prog_ids:
+        # Kod z nejlepsiho evaluation
+        best_prog = {data.best[module_id].id: data.best[module_id]
+                     for module_id in prog_ids if module_id in data.best}
+        if best_prog:
+            codes = session.query(model.SubmittedCode.evaluation,
+                                  model.SubmittedCode.code).\
+                filter(model.SubmittedCode.evaluation.in_(best_prog.keys())).\
+                all()
+            for (eval_id, code) in codes:
+                ev = best_prog[eval_id]
+                data.last_code.setdefault(ev.module, util.programming.LastCode(
+                    code=code, time=ev.time, origin='evaluation'))
+
+        # Moduly bez evaluation: posledni spusteni kodu
+        no_eval = [module_id for module_id in prog_ids
+                   if module_id not in data.best]
+        if no_eval:
+            last = session.query(
+                model.CodeExecution.module.label('module'),
+                func.max(model.CodeExecution.time).label('time'),
+            ).\
+                filter(model.CodeExecution.user == user_id,
+                       model.CodeExecution.module.in_(no_eval)).\
+                group_by(model.CodeExecution.module).\
+                subquery()
+            executions = session.query(model.CodeExecution.module,
+                                       model.CodeExecution.code,
+                                       model.CodeExecution.time).\
+                join(last, and_(last.c.module == model.CodeExecution.module,
+                                last.c.time == model.CodeExecution.time)).\
+                filter(model.CodeExecution.user == user_id).\
+                order_by(desc(model.CodeExecution.id)).\
+                all()
+            for (module_id, code, time) in executions:
+                data.last_code.setdefault(module_id, util.programming.LastCode(
+                    code=code, time=time, origin='execution'))
+
+    if general_ids:
+        files = session.query(model.SubmittedFile.id,
+                              model.SubmittedFile.path,
+                              model.Evaluation.module).\
+            join(model.Evaluation,
+                 model.SubmittedFile.evaluation == model.Evaluation.id).\
+            filter(model.Evaluation.user == user_id,
+                   model.Evaluation.module.in_(general_ids)).\
+            all()
+        data.files.update(util.grouping.group_by(files, lambda f: f.module))
+
+    return data
+
+
+def to_json(module, user_id, data: Optional[UserModulesData] = None):
+    """Pri serializaci vice modulu predavejte 'data' nactena jednou funkci
+    load_user_data(), jinak se nactou pro tento jeden modul."""
+    if data is None:
+        data = load_user_data([module], user_id)
 
-    evaluation = best[0] if best is not None else None
-    task = best[1] if best is not None else None
+    if module.custom and user_id is not None:
+        _module = _load_custom(module, user_id)
+    else:
+        _module = module
+
+    module_json = _info_to_json(_module)
+
+    # Nejlepsi evaluation
+    best = data.best.get(module.id)
 
     if best is not None:
         # ziskame nejlepsi evaluation a podle toho rozhodneme, jak je na tom
         # resitel
-        module_json['state'] = 'correct' if evaluation.ok else 'incorrect'
+        module_json['state'] = 'correct' if best.ok else 'incorrect'
     else:
         module_json['state'] = 'blank'
 
     module_json['score'] =\
-        _module.id if best is not None and task.evaluation_public else None
+        _module.id if best is not None and best.evaluation_public else None
 
     try:
         if _module.type == ModuleType.PROGRAMMING:
             prog = util.programming.to_json(
-                json.loads(_module.data), user_id, _module.id, evaluation, _module.task
+                json.loads(_module.data), user_id, _module.id, _module.task,
+                data.last_code.get(module.id)
             )
             module_json['code'] = prog['code']
             module_json['default_code'] = prog['default_code']
@@ -88,15 +179,8 @@ def to_json(module, user_id):
                 json.loads(_module.data), user_id)
 
         elif _module.type == ModuleType.GENERAL:
-            submittedFiles = session.query(model.SubmittedFile).\
-                join(model.Evaluation,
-                     model.SubmittedFile.evaluation == model.Evaluation.id).\
-                filter(model.Evaluation.user == user_id,
-                       model.Evaluation.module == _module.id).\
-                all()
-
             submittedFiles = [{'id': inst.id, 'filename': os.path.basename(
-                inst.path)} for inst in submittedFiles]
+                inst.path)} for inst in data.files.get(module.id, [])]
 
             module_json['submitted_files'] = submittedFiles
 
@@ -208,6 +292,7 @@ def delete_module(module):
     except BaseException:
         session.rollback()
         raise
+    util.task.invalidate_max_points()
 
 
 def _load_custom(module, user_id):
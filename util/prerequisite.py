@@ -1,4 +1,11 @@
+from threading import Lock
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import db
+from db import session
+import model
 from model import PrerequisiteType
+import util
 
 """
 Prerekvizity uloh maji omezeni:
@@ -6,17 +13,11 @@ Prerekvizity uloh maji omezeni:
   -> (13 && 12) || (15 && 16) validni
   -> (13 || 12) || (15 && 16) validni
   -> (13 || 12) && (15 && 16) NEvalidni
-"""
-
-
-class orList(list):
-    def __init__(self, *args, **kwargs):
-        super(orList, self).__init__(args[0])
+(omezeni plati pro to_json(), vyhodnoceni zvladne libovolny strom)
 
-
-class andList(list):
-    def __init__(self, *args, **kwargs):
-        super(andList, self).__init__(args[0])
+Pro vyhodnoceni se strom prerekvizit prevadi do DNF (n-tice mnozin id uloh),
+ktera se cachuje pro kazdou ulohu (CompiledPrerequisites).
+"""
 
 
 def to_json(prereq):
@@ -55,6 +56,47 @@ def _to_json2(prereq):
         return []
 
 
+Dnf = Tuple[FrozenSet[int], ...]
+
+
+def compile_tree(prereq) -> Optional[Dnf]:
+    """Prevede strom prerekvizit (model.Prerequisite) do disjunktivni normalni
+    formy: n-tice mnozin id uloh, prerekvizita je splnena, pokud je nektera
+    z mnozin cela podmnozinou splnenych uloh.
+    None = uloha nema prerekvizity (vzdy splneno), () = nelze splnit.
+    """
+    if prereq is None:
+        return None
+    return _compile(prereq.type, prereq.task,
+                    [compile_tree(child) for child in prereq.children])
+
+
+def _compile(type_: str, task: Optional[int], children: List[Dnf]) -> Dnf:
+    if type_ == PrerequisiteType.ATOMIC:
+        return (frozenset([task]), ) if task is not None else ()
+
+    if type_ == PrerequisiteType.AND:
+        # (a || b) && (c || d) = ac || ad || bc || bd
+        dnf: Dnf = (frozenset(), )
+        for child in children:
+            dnf = tuple({left | right for left in dnf for right in child})
+        return dnf
+
+    if type_ == PrerequisiteType.OR:
+        return tuple({conj for child in children for conj in child})
+
+    return ()
+
+
+def evaluate(dnf: Optional[Dnf], fully_submitted: Iterable[int]) -> bool:
+    """Vyhodnoti prelozenou prerekvizitu vuci mnozine splnenych uloh"""
+    if dnf is None:
+        return True
+    if not isinstance(fully_submitted, (set, frozenset)):
+        fully_submitted = set(fully_submitted)
+    return any(conj <= fully_submitted for conj in dnf)
+
+
 class PrerequisitiesEvaluator:
 
     def __init__(self, root_prerequisite, fully_submitted):
@@ -62,38 +104,97 @@ class PrerequisitiesEvaluator:
         self.fully_submitted = fully_submitted
 
     def evaluate(self):
-        expr = self._parse_expression(self.root_prerequisite)
-        return self._evaluation_step(expr)
-
-    def _parse_expression(self, prereq):
-        if prereq is None:
+        return evaluate(compile_tree(self.root_prerequisite),
+                        self.fully_submitted)
+
+
+class CompiledPrerequisites:
+    """
+    Cache prelozenych prerekvizit v pameti workeru: { task_id : (id korene
+    prerekvizity, Dnf) }. Cache se naplni najednou jednim dotazem do tabulky
+    prerekvizit, vyhodnoceni uz do databaze nesaha.
+    Platnost je svazana s verzi util.cache 'prerequisites', kterou zvysuje
+    invalidate() (deploy ulohy).
+    """
+
+    VERSION_KEY = 'prerequisites'
+
+    def __init__(self) -> None:
+        self.__version: Optional[str] = None
+        self.__compiled: Dict[int, Tuple[int, Dnf]] = {}
+        self.__lock = Lock()
+
+    def refresh(self) -> None:
+        """Zahodi cache, pokud jiny worker zmenil prerekvizity."""
+        ver = util.cache.version(self.VERSION_KEY)
+        if ver != self.__version:
+            with self.__lock:
+                self.__compiled = {}
+                self.__version = ver
+
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__compiled = {}
+        util.cache.bump(self.VERSION_KEY)
+
+    def get(self, task) -> Optional[Dnf]:
+        if task.prerequisite is None:
             return None
 
-        if prereq.type == PrerequisiteType.ATOMIC:
-            return prereq.task
+        compiled = self.__compiled.get(task.id)
+        if compiled is None or compiled[0] != task.prerequisite:
+            self.__load()
+            compiled = self.__compiled.get(task.id)
+
+        if compiled is None or compiled[0] != task.prerequisite:
+            # Uloha zatim neni commitnuta, prelozime jen jeji strom.
+            return compile_tree(task.prerequisite_obj)
+        return compiled[1]
+
+    def __load(self) -> None:
+        with db.on_primary():
+            rows = session.query(model.Prerequisite.id,
+                                 model.Prerequisite.type,
+                                 model.Prerequisite.parent,
+                                 model.Prerequisite.task).all()
+            roots = session.query(model.Task.id, model.Task.prerequisite).\
+                filter(model.Task.prerequisite != None).all()
+
+        by_id = {row.id: row for row in rows}
+        children = util.grouping.group_by(rows, lambda row: row.parent,
+                                          lambda row: row.id)
+
+        def dnf_of(prereq_id: int) -> Dnf:
+            row = by_id.get(prereq_id)
+            if row is None:
+                return ()
+            return _compile(row.type, row.task,
+                            [dnf_of(child)
+                             for child in children.get(row.id, [])])
+
+        compiled = {
+            task_id: (root_id, dnf_of(root_id)) for task_id, root_id in roots
+        }
+        with self.__lock:
+            self.__compiled = compiled
+
+
+compiled = CompiledPrerequisites()
 
-        if prereq.type == PrerequisiteType.AND:
-            return andList([self._parse_expression(child)
-                            for child in prereq.children])
 
-        if prereq.type == PrerequisiteType.OR:
-            return orList([self._parse_expression(child)
-                           for child in prereq.children])
+def satisfied(task, fully_submitted: Iterable[int]) -> bool:
+    """Jsou splneny prerekvizity ulohy 'task' pri splnenych ulohach
+    'fully_submitted'? Pouziva cache prelozenych prerekvizit, pred serii
+    vyhodnoceni zavolejte refresh().
+    """
+    return evaluate(compiled.get(task), fully_submitted)
 
-    def _evaluation_step(self, expr):
-        if expr is None:
-            return True
 
-        if isinstance(expr, andList):
-            val = True
-            for item in expr:
-                val = val and self._evaluation_step(item)
-            return val
+def refresh() -> None:
+    compiled.refresh()
 
-        if isinstance(expr, orList):
-            val = False
-            for item in expr:
-                val = val or self._evaluation_step(item)
-            return val
 
-        return expr in self.fully_submitted
+def invalidate() -> None:
+    """Zneplatni prelozene prerekvizity ve vsech workerech (volat po zmene
+    prerekvizit, tj. pri deployi ulohy)."""
+    compiled.invalidate()
@@ -25,10 +25,10 @@ def to_json(user, profile, notify, year_obj, basic=False, sensitive: bool = Fals
         task_scores = {task: (points, wave, prereq) for task, points, wave,
                        prereq in util.task.any_submitted(user.id, year_obj.id)}
 
-        adeadline = util.task.after_deadline()
-        fsubmitted = util.task.fully_submitted(user.id, year_obj.id)
-        corrected = util.task.corrected(user.id)
-        autocorrected_full = util.task.autocorrected_full(user.id)
+        resolver = util.task.TaskStatusResolver(
+            user, year_obj.id,
+            waves={wave.id: wave for (_, wave, _) in task_scores.values()}
+        )
         task_max_points_dict = util.task.max_points_dict()
 
         # task_achievements je seznam [(Task,Achievement)] pro vsechny
@@ -43,26 +43,29 @@ def to_json(user, profile, notify, year_obj, basic=False, sensitive: bool = Fals
                    model.Achievement.year == year_obj.id).\
             group_by(model.Task, model.Achievement).\
             all()
+        achievements_by_task = util.grouping.group_by(
+            task_achievements, lambda tsk_ach: tsk_ach[0].id,
+            lambda tsk_ach: tsk_ach[1].id)
 
         return {
             'profile': dict(
                 list(_basic_profile_to_json(user).items()) +
                 list(_full_profile_to_json(user, profile, notify, task_scores,
-                                           year_obj, sensitive=sensitive).items())
+                                           year_obj, sensitive=sensitive,
+                                           fsubmitted=resolver.fsubmitted
+                                           ).items())
             ),
             'tasks': [
                 util.task.to_json(
-                    task, prereq, user, adeadline, fsubmitted, wave,
-                    task.id in corrected, task.id in autocorrected_full,
-                    task_max_points=task_max_points_dict[task.id])
+                    task, prereq, user, wave=wave,
+                    task_max_points=task_max_points_dict[task.id],
+                    resolver=resolver)
                 for task, (points, wave, prereq) in list(task_scores.items())
             ],
             'taskScores': [
                 task_score_to_json(
                     task, points, user,
-                    [ach.id for (_, ach) in
-                        [tsk_ach for tsk_ach in task_achievements
-                            if tsk_ach[0].id == task.id]]
+                    achievements_by_task.get(task.id, [])
                 )
                 for task, (points, _, _) in list(task_scores.items())
             ]
@@ -85,7 +88,8 @@ def _basic_profile_to_json(user: model.User) -> dict:
     }
 
 
-def _full_profile_to_json(user, profile, notify, task_scores, year_obj, sensitive: bool = False):
+def _full_profile_to_json(user, profile, notify, task_scores, year_obj, sensitive: bool = False,
+                          fsubmitted=None):
     """
 
     :param user:
@@ -94,6 +98,7 @@ def _full_profile_to_json(user, profile, notify, task_scores, year_obj, sensitiv
     :param task_scores:
     :param year_obj:
     :param sensitive: it True, include sensitive information like user's address
+    :param fsubmitted: already computed util.task.fully_submitted for the year
     :return:
     """
     points, cheat = util.user.sum_points(user.id, year_obj.id)
@@ -121,7 +126,8 @@ def _full_profile_to_json(user, profile, notify, task_scores, year_obj, sensitiv
         'seasons': [key for (key,) in util.user.active_years(user.id)],
         'percent': successful,
         'results': [task.id for task in list(task_scores.keys())],
-        'tasks_num': len(util.task.fully_submitted(user.id, year_obj.id)),
+        'tasks_num': len(fsubmitted if fsubmitted is not None
+                         else util.task.fully_submitted(user.id, year_obj.id)),
 
         'notify_eval': notify.notify_eval if notify else True,
         'notify_response': notify.notify_response if notify else True,
@@ -0,0 +1,115 @@
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import config
+from util.logger import get_log
+
+"""
+Profilovani pozadavku pomoci cProfile (viz app.py:Profiler).
+
+Pozadavek se profiluje, pokud:
+ * organizator posle hlavicku 'X-Profile: 1' nebo query parametr ?profile,
+ * nebo nahodne s pravdepodobnosti PROFILE_SAMPLE_RATE (config.py,
+   default 0 = vypnuto).
+
+Profil (pstats, lze otevrit napr. `python -m pstats` nebo snakeviz) se ulozi
+do PROFILES_DIR, uchovava se nejvyse PROFILE_MAX_FILES (default 200)
+nejnovejsich profilu. Seznam a stazeni: /admin/profiles.
+"""
+
+PROFILES_DIR = 'data/profiles'
+SAMPLE_RATE = getattr(config, 'PROFILE_SAMPLE_RATE', 0.0)
+MAX_FILES = getattr(config, 'PROFILE_MAX_FILES', 200)
+PROFILE_SUFFIX = '.pstats'
+
+_NAME_RE = re.compile(r'^[\w.-]+\.pstats$')
+
+
+def requested(req) -> bool:
+    """Vrati True, pokud ma byt pozadavek 'req' profilovan"""
+    user = req.context.get('user')
+    if user is not None and user.is_org() and (
+            req.get_header('X-Profile') not in (None, '', '0') or
+            req.get_param('profile') is not None):
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def start() -> cProfile.Profile:
+    profile = cProfile.Profile()
+    profile.enable()
+    return profile
+
+
+def store(profile: cProfile.Profile, method: str, route: Optional[str],
+          duration: float) -> Optional[str]:
+    """Zastavi 'profile' a ulozi ho do PROFILES_DIR, vraci jmeno souboru"""
+    profile.disable()
+    slug = re.sub(r'[^\w]+', '_', route or 'sink').strip('_') or 'root'
+    name = (f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{method}-{slug}-"
+            f"{os.getpid()}-{int(duration * 1000)}ms{PROFILE_SUFFIX}")
+    try:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        profile.dump_stats(os.path.join(PROFILES_DIR, name))
+        _prune()
+    except OSError as e:
+        get_log().error(f"Cannot store profile '{name}': {e}")
+        return None
+    return name
+
+
+def _prune() -> None:
+    profiles = list_profiles()
+    for profile in profiles[MAX_FILES:]:
+        try:
+            os.remove(os.path.join(PROFILES_DIR, profile['name']))
+        except FileNotFoundError:
+            pass
+
+
+def list_profiles() -> List[Dict]:
+    """Ulozene profily od nejnovejsiho"""
+    try:
+        entries = [e for e in os.scandir(PROFILES_DIR)
+                   if e.is_file() and e.name.endswith(PROFILE_SUFFIX)]
+    except FileNotFoundError:
+        return []
+    result = []
+    for entry in entries:
+        try:
+            stat = entry.stat()
+        except FileNotFoundError:
+            continue
+        result.append({
+            'name': entry.name,
+            'size': stat.st_size,
+            'created': datetime.fromtimestamp(stat.st_mtime).isoformat(),
+            'mtime': stat.st_mtime,
+        })
+    result.sort(key=lambda p: p['mtime'], reverse=True)
+    for profile in result:
+        del profile['mtime']
+    return result
+
+
+def profile_path(name: str) -> Optional[str]:
+    """Cesta k profilu 'name' nebo None, pokud neexistuje (nebo je jmeno
+    neplatne)."""
+    if not _NAME_RE.match(name):
+        return None
+    path = os.path.join(PROFILES_DIR, name)
+    return path if os.path.isfile(path) else None
+
+
+def render_text(path: str, sort: str = 'cumulative', limit: int = 50) -> str:
+    """Textovy vypis profilu (jako `python -m pstats`)"""
+    out = io.StringIO()
+    stats = pstats.Stats(path, stream=out)
+    stats.strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
@@ -1,9 +1,15 @@
+import atexit
+import datetime
+import fcntl
+import queue
 import random
+import threading
 import time
+from collections import OrderedDict
 from hashlib import sha256
 from pathlib import Path
 from secrets import token_hex
-from typing import Optional, List, Tuple, Callable
+from typing import Dict, Optional, List, NamedTuple, Tuple, Callable
 from multiprocessing import Process, Value, Lock
 
 from humanfriendly import parse_timespan, parse_size
@@ -14,10 +20,11 @@ import stat
 import subprocess
 from sqlalchemy import desc
 
+import config
 import util.config
 from db import session
 import model
-from util.logger import audit_log
+from util.logger import audit_log, get_log
 
 r"""
 Specifikace \data v databazi modulu pro "programming":
@@ -36,6 +43,16 @@ DEFAULT_META_TAG = '#KSI_META_OUTPUT_0a859a#'
 MODULE_LIB_PATH = 'data/module_lib/'
 EXEC_PATH = '/tmp/box/'
 MAX_CONCURRENT_EXEC = 3
+# Pocet predem inicializovanych sandboxu v kazdem workeru (BoxPool)
+BOX_POOL_SIZE = getattr(config, 'SANDBOX_POOL_SIZE', 1)
+# Soubory zamku slotu (SlotAllocator), mimo EXEC_PATH
+SLOT_PATH = '/tmp/box-slots/'
+# Pocet id sandboxu jedne instance (box_prefix_id + 3 cislice)
+BOX_IDS = 1000
+# Fronta spusteni cekajicich na volny sandbox (ExecScheduler), per worker
+EXEC_QUEUE_SIZE = getattr(config, 'EXEC_QUEUE_SIZE', 32)
+EXEC_QUEUE_TIMEOUT = getattr(config, 'EXEC_QUEUE_TIMEOUT', 20)
+EXEC_QUEUE_POLL = 0.1
 STORE_PATH = 'data/exec/'
 SOURCE_FILE = 'source'
 RESULT_FILE = 'eval.out'
@@ -121,7 +138,16 @@ class Reporter(object):
         return self
 
 
-def to_json(db_dict, user_id, module_id, last_eval, task_id):
+class LastCode(NamedTuple):
+    code: str
+    time: datetime.datetime
+    origin: str  # 'evaluation' | 'execution'
+
+
+def to_json(db_dict, user_id, module_id, task_id,
+            last_code: Optional[LastCode]):
+    """'last_code' je posledni kod resitele (viz util.module.load_user_data)
+    """
     code = {
         'default_code': db_dict['programming']['default_code'],
         'code': db_dict['programming']['default_code'],
@@ -131,26 +157,10 @@ def to_json(db_dict, user_id, module_id, last_eval, task_id):
     code["edulint_source_id"] = f"{util.config.seminar_name_short()}:taskId_{task_id}:moduleId_{module_id}:userId_{user_id_hashed}"
 
     # Pick last participant`s code and return it to participant.
-    if last_eval is not None:
-        submitted = session.query(model.SubmittedCode).\
-            filter(model.SubmittedCode.evaluation == last_eval.id).\
-            first()
-
-        if submitted is not None:
-            code['code'] = submitted.code
-            code['last_datetime'] = last_eval.time
-            code['last_origin'] = 'evaluation'
-    else:
-        execution = session.query(model.CodeExecution).\
-            filter(model.CodeExecution.module == module_id,
-                   model.CodeExecution.user == user_id).\
-            order_by(desc(model.CodeExecution.time)).\
-            first()
-
-        if execution is not None:
-            code['code'] = execution.code
-            code['last_datetime'] = execution.time
-            code['last_origin'] = 'execution'
+    if last_code is not None:
+        code['code'] = last_code.code
+        code['last_datetime'] = last_code.time
+        code['last_origin'] = last_code.origin
 
     return code
 
@@ -181,7 +191,7 @@ def evaluate(task, module, user_id, code, eval_id, reporter: Reporter):
         }
 
     try:
-        box_id = init_exec_environment()
+        box_id = scheduler.lease(user_id)
     except ENoFreeBox:
         reporter += "Reached limit of concurrent tasks!\n"
         return {
@@ -218,7 +228,7 @@ def evaluate(task, module, user_id, code, eval_id, reporter: Reporter):
                            'evaluation\n' + str(eval_id) + '\n')
 
     finally:
-        cleanup_exec_environment(box_id)
+        scheduler.release(box_id)
 
     if res['cheat']:
         audit_log(
@@ -250,25 +260,176 @@ def evaluate(task, module, user_id, code, eval_id, reporter: Reporter):
     return res
 
 
+class Slot(NamedTuple):
+    index: int
+    fd: int
+
+
+class SlotAllocator:
+    """
+    Sloty sdilene vsemi procesy na stroji. Slot 'index' ze skupiny 'name' je
+    obsazen, dokud nektery proces drzi flock na souboru
+    '<path>/<name>-<index>.lock'. Zamek uvolni jadro i pri padu procesu,
+    sloty po spadlych workerech se tedy uvolni samy.
+    Soubory zamku se nemazou (smazani drzeneho zamku by umoznilo druhy
+    zamek na novem souboru).
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    def acquire_index(self, name: str, index: int) -> Optional[Slot]:
+        """Obsadi slot 'index', vraci None, pokud je obsazeny"""
+        os.makedirs(self.path, exist_ok=True)
+        fd = os.open(os.path.join(self.path, f"{name}-{index}.lock"),
+                     os.O_RDWR | os.O_CREAT, 0o660)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return Slot(index, fd)
+
+    def acquire(self, name: str, count: int, start: int = 0) -> Optional[Slot]:
+        """Obsadi prvni volny slot z 'count' slotu (od 'start'), vraci None,
+        pokud jsou vsechny obsazene."""
+        for i in range(count):
+            slot = self.acquire_index(name, (start + i) % count)
+            if slot is not None:
+                return slot
+        return None
+
+    @staticmethod
+    def release(slot: Slot) -> None:
+        # Zavrenim deskriptoru se uvolni i flock
+        os.close(slot.fd)
+
+    def in_use(self, name: str, count: int) -> int:
+        """Pocet obsazenych slotu (vcetne slotu tohoto procesu). Zamky
+        zjistuje z /proc/locks, sloty sam nezamyka (jinak by soubezny
+        acquire() mohl najit vsechny sloty obsazene)."""
+        files = set()
+        for index in range(count):
+            try:
+                st = os.stat(os.path.join(self.path, f"{name}-{index}.lock"))
+            except FileNotFoundError:
+                continue
+            files.add((os.major(st.st_dev), os.minor(st.st_dev), st.st_ino))
+        if not files:
+            return 0
+
+        held = set()
+        with open('/proc/locks', 'r') as f:
+            for line in f:
+                # '1: FLOCK  ADVISORY  WRITE <pid> <major>:<minor>:<inode> ...'
+                # (cekajici zamky maji za cislem '->', ty se nepocitaji)
+                fields = line.split()
+                if len(fields) < 6 or fields[1] != 'FLOCK':
+                    continue
+                major, minor, inode = fields[5].split(':')
+                key = (int(major, 16), int(minor, 16), int(inode))
+                if key in files:
+                    held.add(key)
+        return len(held)
+
+
+slots = SlotAllocator(SLOT_PATH)
+
+# box_id -> slot id sandboxu drzeny timto procesem
+_box_slots: Dict[str, Slot] = {}
+_box_slots_lock = threading.Lock()
+
+
+def _exec_slots_name() -> str:
+    return f"exec-{util.config.box_prefix_id()}"
+
+
+def _box_slots_name() -> str:
+    return f"box-{util.config.box_prefix_id()}"
+
+
+def boxes_in_use() -> int:
+    """Pocet prave bezicich spusteni teto instance (ve vsech workerech)"""
+    return slots.in_use(_exec_slots_name(), MAX_CONCURRENT_EXEC)
+
+
+def acquire_exec_slot() -> Slot:
+    """Obsadi jedno z MAX_CONCURRENT_EXEC mist pro spusteni kodu (spolecne
+    vsem workerum). Vyhazuje ENoFreeBox."""
+    slot = slots.acquire(_exec_slots_name(), MAX_CONCURRENT_EXEC)
+    if slot is None:
+        raise ENoFreeBox("Reached limit of concurrent tasks!")
+    return slot
+
+
 def find_free_box_id() -> Optional[str]:
     """
-    limits = prog_info["limits"] if "limits" in prog_info else {}
-    Returns is of the first available sandbox directory. Searched for
-    non-existing directories in /tmp/box.
+    Returns id of a free sandbox, the id is reserved (flock) for this process
+    until cleanup_exec_environment(). Leftovers of a crashed process with the
+    same id are cleaned first. Returns None if all BOX_IDS ids are taken.
     """
-    dir_boxes = Path(EXEC_PATH)
     box_prefix_id = util.config.box_prefix_id()
-
-    if len(list(
-            filter(lambda x: x.name.startswith(f"{box_prefix_id}"), dir_boxes.iterdir())
-    )) >= MAX_CONCURRENT_EXEC:
+    slot = slots.acquire(_box_slots_name(), BOX_IDS,
+                         start=random.randrange(BOX_IDS))
+    if slot is None:
         return None
 
-    while True:
-        box_name = f"{box_prefix_id}{random.randint(0, 1000):03d}"
-        if not dir_boxes.joinpath(box_name).exists():
-            return box_name
-        time.sleep(0.001)
+    box_name = f"{box_prefix_id}{slot.index:03d}"
+    with _box_slots_lock:
+        _box_slots[box_name] = slot
+    if os.path.isdir(os.path.join(EXEC_PATH, box_name)):
+        _cleanup_box(box_name)
+    return box_name
+
+
+def _release_box_id(box_id: str) -> None:
+    with _box_slots_lock:
+        slot = _box_slots.pop(box_id, None)
+    if slot is not None:
+        slots.release(slot)
+
+
+def reclaim_stale_boxes() -> int:
+    """Uklidi sandboxy v EXEC_PATH, ktere nedrzi zadny proces (pozustatky
+    spadlych workeru). Vraci pocet uklizenych sandboxu."""
+    box_prefix_id = str(util.config.box_prefix_id())
+    reclaimed = 0
+    try:
+        names = os.listdir(EXEC_PATH)
+    except FileNotFoundError:
+        return 0
+    for name in names:
+        index = name[len(box_prefix_id):]
+        if not name.startswith(box_prefix_id) or not index.isdigit() or \
+                len(index) != 3:
+            continue
+        slot = slots.acquire_index(_box_slots_name(), int(index))
+        if slot is None:
+            continue  # sandbox pouziva jiny proces
+        try:
+            _cleanup_box(name)
+            reclaimed += 1
+        finally:
+            slots.release(slot)
+    return reclaimed
+
+
+def prepare_exec_path() -> None:
+    """Create EXEC_PATH with proper permissions (for sandbox), called once at
+    startup of a process running code."""
+    # Bezici sandboxy ostatnich workeru se nemazou, uklizi se jen sandboxy po
+    # spadlych procesech
+    try:
+        os.makedirs(EXEC_PATH)
+    except FileExistsError:
+        pass
+
+    p = subprocess.Popen(["setfacl", "-d", "-m", "group:ksi:rwx", EXEC_PATH])
+    p.wait()
+    if p.returncode != 0:
+        raise Exception("Cannot change umask to %s!" % (EXEC_PATH))
+
+    reclaim_stale_boxes()
 
 
 def init_exec_environment():
@@ -281,8 +442,17 @@ def init_exec_environment():
     box_id = find_free_box_id()
 
     if box_id is None:
-        raise ENoFreeBox("Reached limit of concurrent tasks!")
+        raise ENoFreeBox("No free sandbox id!")
 
+    try:
+        _isolate_init(box_id)
+    except BaseException:
+        cleanup_exec_environment(box_id)
+        raise
+    return box_id
+
+
+def _isolate_init(box_id: str) -> None:
     # Run isolate --init
     p = subprocess.Popen(
         ["isolate", "-b", box_id, "--init"],
@@ -299,12 +469,16 @@ def init_exec_environment():
             f"{stderr}"
         )
 
-    return box_id
-
 
 def cleanup_exec_environment(box_id):
-    """Clean-up sandbox data."""
+    """Clean-up sandbox data and release its id."""
+    try:
+        _cleanup_box(box_id)
+    finally:
+        _release_box_id(box_id)
 
+
+def _cleanup_box(box_id):
     sandbox_root = os.path.join(EXEC_PATH, box_id)
     if os.path.isdir(sandbox_root):
         p = subprocess.Popen(
@@ -327,6 +501,233 @@ def cleanup_exec_environment(box_id):
             pass
 
 
+class BoxPool:
+    """
+    Predem inicializovane sandboxy (isolate --init) jednoho workeru.
+
+    lease() vrati volny inicializovany sandbox (hit), pokud zadny neni,
+    inicializuje novy v ramci pozadavku (miss). release() preda sandbox
+    vlaknu na pozadi, ktere ho uklidi (isolate --cleanup, smazani adresare)
+    a doplni pool na BOX_POOL_SIZE novym sandboxem. Pozadavek tedy neceka na
+    --init ani --cleanup.
+
+    Pool neresi limit MAX_CONCURRENT_EXEC, ten hlida ExecScheduler (volne
+    sandboxy v poolu nezabiraji misto pro spusteni). Vlakno se spousti az
+    pri prvnim pouziti v kazdem procesu, pool se plni az po prvnim spusteni
+    kodu.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.__lock = threading.Lock()
+        self.__idle: List[str] = []
+        self.__filling = 0
+        self.__tasks: "queue.Queue[Optional[str]]" = queue.Queue()
+        self.__pid: Optional[int] = None
+        self.hits = 0
+        self.misses = 0
+        self.resets = 0
+        self.reset_time = 0.0
+
+    def lease(self) -> str:
+        """Vrati id sandboxu pripraveneho ke spusteni kodu.
+        Vyhazuje ENoFreeBox (dosla id sandboxu) a EIsolateError."""
+        self.__ensure_thread()
+        with self.__lock:
+            box_id = self.__idle.pop() if self.__idle else None
+            if box_id is not None:
+                self.hits += 1
+
+        if box_id is None:
+            box_id = init_exec_environment()
+            with self.__lock:
+                self.misses += 1
+
+        self.__tasks.put(None)  # doplnit pool
+        return box_id
+
+    def release(self, box_id: str) -> None:
+        """Vrati pouzity sandbox, uklidi se na pozadi"""
+        self.__ensure_thread()
+        self.__tasks.put(box_id)
+
+    def stats(self) -> dict:
+        with self.__lock:
+            return {
+                'idle': len(self.__idle),
+                'hits': self.hits,
+                'misses': self.misses,
+                'resets': self.resets,
+                'reset_time': self.reset_time,
+            }
+
+    def shutdown(self) -> None:
+        """Uklidi volne sandboxy (pri ukonceni workeru)"""
+        if self.__pid != os.getpid():
+            return
+        with self.__lock:
+            idle, self.__idle = self.__idle, []
+        for box_id in idle:
+            cleanup_exec_environment(box_id)
+
+    def __ensure_thread(self) -> None:
+        if self.__pid == os.getpid():
+            return
+        with self.__lock:
+            if self.__pid == os.getpid():
+                return
+            # Po forku nejsou sandboxy ani vlakno rodice platne
+            self.__idle = []
+            self.__filling = 0
+            self.__tasks = queue.Queue()
+            threading.Thread(target=self.__work, args=(self.__tasks,),
+                             name='box-pool', daemon=True).start()
+            self.__pid = os.getpid()
+
+    def __work(self, tasks: "queue.Queue[Optional[str]]") -> None:
+        while True:
+            box_id = tasks.get()
+            try:
+                if box_id is not None:
+                    self.__reset(box_id)
+                self.__fill()
+            except Exception as e:
+                get_log().error(f"Sandbox pool error: {e}")
+
+    def __reset(self, box_id: str) -> None:
+        start = time.perf_counter()
+        cleanup_exec_environment(box_id)
+        with self.__lock:
+            self.resets += 1
+            self.reset_time += time.perf_counter() - start
+
+    def __fill(self) -> None:
+        while True:
+            with self.__lock:
+                if len(self.__idle) + self.__filling >= self.size:
+                    return
+                self.__filling += 1
+            try:
+                box_id = init_exec_environment()
+            finally:
+                with self.__lock:
+                    self.__filling -= 1
+            with self.__lock:
+                self.__idle.append(box_id)
+
+
+box_pool = BoxPool(BOX_POOL_SIZE)
+atexit.register(box_pool.shutdown)
+
+
+class ExecScheduler:
+    """
+    Fronta pred sandboxem: pri dosazeni MAX_CONCURRENT_EXEC spusteni ceka
+    na volne misto (nejvyse 'timeout' sekund) misto okamziteho ENoFreeBox.
+
+    Uzivatele se stridaji (round-robin), kazdy uzivatel dostane nejvyse jeden
+    sandbox za kolo, i kdyz ma ve fronte vic spusteni. Fronta je omezena na
+    'max_size' cekajicich. Mista (acquire_exec_slot()) jsou spolecna vsem
+    workerum, proto cekajici periodicky (EXEC_QUEUE_POLL) zkousi misto
+    ziskat.
+    """
+
+    def __init__(self, pool: BoxPool, max_size: int, timeout: float) -> None:
+        self.pool = pool
+        self.max_size = max_size
+        self.timeout = timeout
+        self.__cond = threading.Condition()
+        # user_id -> pocet cekajicich spusteni, poradi = poradi ve fronte
+        self.__waiting: "OrderedDict[int, int]" = OrderedDict()
+        self.__depth = 0
+        # box_id -> misto pro spusteni, ktere sandbox zabira
+        self.__slots: Dict[str, Slot] = {}
+        self.timeouts = 0
+        self.rejected = 0
+
+    def lease(self, user_id: int) -> str:
+        """Vrati id sandboxu, pripadne pocka ve fronte.
+        Vyhazuje ENoFreeBox (plna fronta, vyprseni cekani)."""
+        if self.__depth == 0:
+            try:
+                box_id = self.__try_lease()
+                util.metrics.registry.observe_exec_wait(0.0)
+                return box_id
+            except ENoFreeBox:
+                pass
+
+        with self.__cond:
+            if self.__depth >= self.max_size:
+                self.rejected += 1
+                raise ENoFreeBox("Execution queue is full!")
+            self.__waiting[user_id] = self.__waiting.get(user_id, 0) + 1
+            self.__depth += 1
+
+        start = time.perf_counter()
+        deadline = start + self.timeout
+        try:
+            while True:
+                with self.__cond:
+                    first = next(iter(self.__waiting)) == user_id
+                if first:
+                    try:
+                        box_id = self.__try_lease()
+                    except ENoFreeBox:
+                        pass
+                    else:
+                        util.metrics.registry.observe_exec_wait(
+                            time.perf_counter() - start)
+                        return box_id
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    with self.__cond:
+                        self.timeouts += 1
+                    raise ENoFreeBox(f"No free box in {self.timeout} s!")
+                with self.__cond:
+                    self.__cond.wait(min(remaining, EXEC_QUEUE_POLL))
+        finally:
+            with self.__cond:
+                self.__depth -= 1
+                self.__waiting[user_id] -= 1
+                # Uzivatel jde na konec fronty (dalsi kolo)
+                count = self.__waiting.pop(user_id)
+                if count > 0:
+                    self.__waiting[user_id] = count
+                self.__cond.notify_all()
+
+    def __try_lease(self) -> str:
+        slot = acquire_exec_slot()
+        try:
+            box_id = self.pool.lease()
+        except BaseException:
+            slots.release(slot)
+            raise
+        with self.__cond:
+            self.__slots[box_id] = slot
+        return box_id
+
+    def release(self, box_id: str) -> None:
+        with self.__cond:
+            slot = self.__slots.pop(box_id, None)
+        if slot is not None:
+            slots.release(slot)
+        self.pool.release(box_id)
+        with self.__cond:
+            self.__cond.notify_all()
+
+    def stats(self) -> dict:
+        with self.__cond:
+            return {
+                'depth': self.__depth,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+            }
+
+
+scheduler = ExecScheduler(box_pool, EXEC_QUEUE_SIZE, EXEC_QUEUE_TIMEOUT)
+
+
 def code_execution_dir(user_id: int, module_id: int) -> str:
     dst_path = os.path.abspath(os.path.join(STORE_PATH,
                                             "module_" + str(module_id),
@@ -373,7 +774,7 @@ def run(module, user_id, code, exec_id, reporter):
         }
 
     try:
-        box_id = init_exec_environment()
+        box_id = scheduler.lease(user_id)
     except ENoFreeBox as e:
         reporter += str(e) + "\n"
         return {
@@ -395,7 +796,7 @@ def run(module, user_id, code, exec_id, reporter):
                 store_exec(box_id, user_id, module.id,
                            'execution\n' + str(exec_id) + '\n')
     finally:
-        cleanup_exec_environment(box_id)
+        scheduler.release(box_id)
 
     if res['cheat']:
         audit_log(
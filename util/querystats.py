@@ -0,0 +1,102 @@
+import threading
+from time import perf_counter
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+import config
+
+"""
+Statistiky SQL dotazu v ramci jednoho HTTP pozadavku.
+
+Middleware (app.py:DBSession) na zacatku pozadavku zavola start(), eventy
+SQLAlchemy enginu (install()) pak pocitaji dotazy vlakna, ktere pozadavek
+obsluhuje (gthread worker = jedno vlakno na pozadavek). Dotazy mimo
+pozadavek (vlakna na pozadi) se nepocitaji.
+
+Vysledek se vypisuje v access logu (util/access_log.py) a posila
+organizatorum v hlavicce Server-Timing. Pozadavky nad limity (config.py,
+volitelne) se loguji jako warning:
+ * SQL_WARN_QUERY_COUNT: pocet dotazu (default 50),
+ * SQL_WARN_DB_TIME: celkovy cas v databazi v sekundach (default 1.0).
+"""
+
+WARN_QUERY_COUNT = getattr(config, 'SQL_WARN_QUERY_COUNT', 50)
+WARN_DB_TIME = getattr(config, 'SQL_WARN_DB_TIME', 1.0)
+
+# Delka SQL prikazu, ktera se uklada jako nejpomalejsi dotaz
+STATEMENT_MAX_LENGTH = 300
+
+
+class QueryStats:
+    def __init__(self) -> None:
+        self.started = perf_counter()
+        self.count = 0
+        self.db_time = 0.0
+        self.slowest_time = 0.0
+        self.slowest_statement: Optional[str] = None
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.db_time += duration
+        if duration > self.slowest_time:
+            self.slowest_time = duration
+            self.slowest_statement = ' '.join(statement.split())[
+                :STATEMENT_MAX_LENGTH]
+
+    @property
+    def elapsed(self) -> float:
+        return perf_counter() - self.started
+
+    def over_threshold(self) -> bool:
+        return self.count > WARN_QUERY_COUNT or self.db_time > WARN_DB_TIME
+
+    def server_timing(self) -> str:
+        """Hodnota hlavicky Server-Timing (casy v milisekundach)"""
+        return (f'db;dur={self.db_time * 1000:.1f};desc="{self.count} queries", '
+                f'db-slowest;dur={self.slowest_time * 1000:.1f}, '
+                f'total;dur={self.elapsed * 1000:.1f}')
+
+
+_local = threading.local()
+
+
+def start() -> QueryStats:
+    """Zacne pocitat dotazy aktualniho vlakna"""
+    _local.stats = QueryStats()
+    return _local.stats
+
+
+def stop() -> Optional[QueryStats]:
+    """Ukonci pocitani dotazu aktualniho vlakna a vrati statistiky"""
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    return stats
+
+
+def current() -> Optional[QueryStats]:
+    return getattr(_local, 'stats', None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    conn.info['querystats_start'] = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    stats = current()
+    if stats is not None:
+        stats.record(statement,
+                     perf_counter() - conn.info['querystats_start'])
+
+
+def install(*engines: Optional[Engine]) -> None:
+    """Zaregistruje mereni dotazu na enginech 'engines' (None se ignoruje)"""
+    for engine in engines:
+        if engine is None or event.contains(
+                engine, 'before_cursor_execute', _before_cursor_execute):
+            continue
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
@@ -0,0 +1,36 @@
+import json
+import re
+from typing import Any
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+"""
+Serializace odpovedi endpointu do JSONu.
+
+Vychozi je kompaktni vystup (bez odsazeni a razeni klicu). Pokud je
+nainstalovan orjson, pouzije se pro kompaktni vystup (vyrazne rychlejsi nez
+json). Citelny vystup (odsazeni, serazene klice) si klient vyzada parametrem
+?pretty nebo parametrem v Accept hlavicce: 'application/json; pretty=1'.
+"""
+
+_ACCEPT_PRETTY = re.compile(r'application/json[^,]*;\s*pretty\b', re.I)
+
+
+def encode_json(result: Any, pretty: bool = False) -> str:
+    if pretty:
+        return json.dumps(result, sort_keys=True, indent=4,
+                          ensure_ascii=False)
+    if orjson is not None:
+        return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS).\
+            decode('utf-8')
+    return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+
+
+def pretty_requested(req) -> bool:
+    """Chce klient citelny JSON?"""
+    if req.get_param_as_bool('pretty', blank_as_true=True):
+        return True
+    return bool(req.accept and _ACCEPT_PRETTY.search(req.accept))
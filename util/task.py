@@ -1,11 +1,16 @@
 import datetime
-from typing import Dict, List, Tuple, Optional, Any, TypedDict, Set
+from bisect import bisect_left
+from threading import Lock
+from typing import AbstractSet, Dict, FrozenSet, List, Tuple, Optional, Any, \
+    TypedDict, Set
 
 from sqlalchemy import func, distinct, or_, and_, desc
 
+import db
 from db import session
 import model
 import util
+import util.cache
 
 
 class TaskStatus:
@@ -86,13 +91,75 @@ def any_submitted(user_id: int, year_id: int)\
         group_by(model.Task).all()
 
 
-def after_deadline() -> Set[int]:
-    return {
-        int(task.id) for task in
-        (session.query(model.Task).
-         filter(model.Task.time_deadline < datetime.datetime.utcnow()).
-         all())
-    }
+class DeadlineIndex:
+    """
+    Serazeny seznam (deadline, task_id) vsech uloh v pameti workeru.
+    Mnozina uloh po deadline se pri dalsim volani jen doplni o ulohy, jejichz
+    deadline mezitim nastal (bez dotazu do databaze). Seznam se znovu nacita
+    jen pri zmene verze util.cache 'deadlines' (deploy ulohy, vytvoreni ci
+    smazani ulohy), viz invalidate_deadlines().
+    """
+
+    VERSION_KEY = 'deadlines'
+
+    def __init__(self) -> None:
+        self.__version: Optional[str] = None
+        self.__deadlines: List[Tuple[datetime.datetime, int]] = []
+        self.__passed_cnt = 0
+        self.__passed: FrozenSet[int] = frozenset()
+        self.__lock = Lock()
+
+    def __load(self, ver: str) -> None:
+        with db.on_primary():
+            rows = session.query(model.Task.id, model.Task.time_deadline).\
+                filter(model.Task.time_deadline != None).all()
+        self.__deadlines = sorted(
+            (deadline, task_id) for (task_id, deadline) in rows
+        )
+        self.__passed_cnt = 0
+        self.__passed = frozenset()
+        self.__version = ver
+
+    def __update(self, now: datetime.datetime) -> None:
+        ver = util.cache.version(self.VERSION_KEY)
+        if ver != self.__version:
+            self.__load(ver)
+
+        if (self.__passed_cnt < len(self.__deadlines) and
+                self.__deadlines[self.__passed_cnt][0] < now):
+            # (deadline, id) < (now, ) <=> deadline < now
+            cnt = bisect_left(self.__deadlines, (now, ))
+            self.__passed = self.__passed | {
+                task_id for (_, task_id) in
+                self.__deadlines[self.__passed_cnt:cnt]
+            }
+            self.__passed_cnt = cnt
+
+    def after_deadline(self) -> FrozenSet[int]:
+        """Vraci mnozinu id uloh, jejichz deadline uz nastal"""
+        with self.__lock:
+            self.__update(datetime.datetime.utcnow())
+            return self.__passed
+
+    def next_deadline(self) -> Optional[datetime.datetime]:
+        """Vraci nejblizsi budouci deadline (None, pokud zadny neni)"""
+        with self.__lock:
+            self.__update(datetime.datetime.utcnow())
+            if self.__passed_cnt < len(self.__deadlines):
+                return self.__deadlines[self.__passed_cnt][0]
+            return None
+
+
+deadlines = DeadlineIndex()
+
+
+def after_deadline() -> FrozenSet[int]:
+    return deadlines.after_deadline()
+
+
+def invalidate_deadlines() -> None:
+    """Volat po zmene deadlinu ulohy a po vytvoreni ci smazani ulohy."""
+    util.cache.bump(DeadlineIndex.VERSION_KEY)
 
 
 def max_points(task_id: int, bonus: bool = False) -> float:
@@ -105,8 +172,24 @@ def max_points(task_id: int, bonus: bool = False) -> float:
     return float(points) if points else 0.0
 
 
+# Maximalni body uloh, vln a rocniku se meni jen deployem ulohy, pridanim nebo
+# smazanim ulohy / modulu / vlny / rocniku -> cachujeme ve workeru.
+_max_points_cache = util.cache.VersionedCache('max-points')
+
+
+def invalidate_max_points() -> None:
+    """Zneplatni cache max_points_*_dict ve vsech workerech. Volat po kazde
+    zmene modulu (max_points, bonus), uloh, vln nebo rocniku."""
+    _max_points_cache.invalidate()
+
+
 def max_points_dict(bonus: bool = False) -> Dict[int, float]:
     """Vraci {task_id: max_points}"""
+    return _max_points_cache.get(('task', bonus),
+                                 lambda: _max_points_dict(bonus))
+
+
+def _max_points_dict(bonus: bool) -> Dict[int, float]:
     # Musime si davat pozor na to, ze uloha muze byt bez modulu
     # points_per_task musi vratit i ulohy bez modulu (v tom pripade vrati
     #  points jako Null)
@@ -151,6 +234,11 @@ def _max_points_per_wave(bonus: bool = False):
 
 def max_points_wave_dict(bonus: bool = False) -> Dict[int, Tuple[float, int]]:
     """Vraci slovnik s klicem id vlny a hodnotami (max_points, task_count)"""
+    return _max_points_cache.get(('wave', bonus),
+                                 lambda: _max_points_wave_dict(bonus))
+
+
+def _max_points_wave_dict(bonus: bool) -> Dict[int, Tuple[float, int]]:
     return {
         wave.id: (wave.points if wave.points else 0.0,
                   wave.tasks_count if wave.tasks_count else 0)
@@ -162,6 +250,11 @@ def max_points_year_dict(bonus: bool = False) -> Dict[int, Tuple[float, int]]:
     """Vraci slovnik s klicem year.id a hodnotami
     (year_max_points, year_tasks_count)
     """
+    return _max_points_cache.get(('year', bonus),
+                                 lambda: _max_points_year_dict(bonus))
+
+
+def _max_points_year_dict(bonus: bool) -> Dict[int, Tuple[float, int]]:
     points_per_wave = _max_points_per_wave(bonus).subquery()
     points_per_year = session.query(
         model.Year.id.label('id'),
@@ -214,15 +307,19 @@ def sum_points(year_id: int, bonus: bool) -> float:
     return val if val is not None else 0.0
 
 
-def corrected(user_id: int) -> List[int]:
+def corrected(user_id: int, year_id: Optional[int] = None) -> List[int]:
     """vraci seznam id vsech opravenych uloh daneho uzivatele
     tzn. u uloh, ktere jsou odevzdavany opakovane (automaticky vyhodnocovane)
     vraci ulohu, pokud resitel udelal submit alespon jednoho
     (teoreticky spatneho) reseni.
+    Pokud je vyplnen 'year_id', vraci jen ulohy daneho rocniku.
     """
-    return [r for (r, ) in session.query(model.Task.id).
-            filter(model.Task.evaluation_public).
-            join(model.Module, model.Module.task == model.Task.id).
+    q = session.query(model.Task.id).filter(model.Task.evaluation_public)
+    if year_id is not None:
+        q = q.join(model.Wave, model.Task.wave == model.Wave.id).filter(
+            model.Wave.year == year_id)
+    return [r for (r, ) in
+            q.join(model.Module, model.Module.task == model.Task.id).
             join(model.Evaluation, model.Evaluation.module == model.Module.id).
             filter(model.Evaluation.user == user_id).
             group_by(model.Task).all()]
@@ -235,13 +332,18 @@ def comment_thread(task_id: int, user_id: int) -> Optional[int]:
     return query.thread if query is not None else None
 
 
-def autocorrected_full(user_id: int) -> List[int]:
+def autocorrected_full(user_id: int, year_id: Optional[int] = None)\
+        -> List[int]:
     """Vraci seznam automaticky opravovanych uloh, ktere maji plny pocet bodu.
     Pokud uloha nema automaticky opravovane moduly, vrati ji taky.
+    Pokud je vyplnen 'year_id', vraci jen ulohy daneho rocniku.
     """
     q = session.query(model.Task.id.label('task_id'),
-                      func.count(distinct(model.Module.id)).label('mod_cnt')).\
-        join(model.Module, model.Module.task == model.Task.id).\
+                      func.count(distinct(model.Module.id)).label('mod_cnt'))
+    if year_id is not None:
+        q = q.join(model.Wave, model.Task.wave == model.Wave.id).filter(
+            model.Wave.year == year_id)
+    q = q.join(model.Module, model.Module.task == model.Task.id).\
         filter(model.Module.bonus == False).group_by(model.Task)
 
     max_modules_count = q.subquery()
@@ -267,7 +369,7 @@ def autocorrected_full(user_id: int) -> List[int]:
 
 def status(task: model.Task,
            user: model.User,
-           adeadline: Optional[Set[int]] = None,
+           adeadline: Optional[AbstractSet[int]] = None,
            fsubmitted: Optional[Dict[int, int]] = None,
            wave: Optional[model.Wave] = None,
            corr: Optional[bool] = None,
@@ -276,6 +378,8 @@ def status(task: model.Task,
     pri hromadnem ziskavani stavu je mozne je vyplnit a pocet SQL dotazu bude
     mensi.
     Pokud jsou None, potrebne informace se zjisti z databaze.
+    Prerekvizity se vyhodnocuji z cache util.prerequisite, hromadne
+    zjistovani stavu proto provadejte pres TaskStatusResolver.
     """
     if wave is None:
         wave = session.query(model.Wave).get(task.wave)
@@ -309,7 +413,7 @@ def status(task: model.Task,
     if corr and acfull:
         return TaskStatus.DONE
 
-    if not fsubmitted:
+    if fsubmitted is None:
         fsubmitted = fully_submitted(user.id)
 
     # Pokud je uloha odevzdana a jeste neopravena, je CORRECTING
@@ -323,12 +427,76 @@ def status(task: model.Task,
 
     # Pokud nenastal ani jeden z vyse zminenych pripadu, otevreme ulohu, pokud
     # jsou splneny prerekvizity
-    return TaskStatus.BASE if (util.PrerequisitiesEvaluator(
-            task.prerequisite_obj, currently_active).evaluate() or
+    return TaskStatus.BASE if (util.prerequisite.satisfied(
+            task, currently_active) or
             user.role in ('org', 'admin', 'tester'))\
         else TaskStatus.LOCKED
 
 
+class TaskStatusResolver:
+    """
+    Hromadne zjistovani stavu uloh (TaskStatus) jednoho uzivatele v jednom
+    rocniku. Vsechna potrebna data (ulohy po deadline, plne odevzdane,
+    opravene a plne automaticky opravene ulohy, vlny) se nactou pevnym
+    poctem SQL dotazu pri vytvoreni, stav jednotlivych uloh se pak pocita
+    bez dalsich dotazu.
+
+    Pouziti:
+        resolver = util.task.TaskStatusResolver(user, year_id)
+        resolver.status(task)
+    nebo pro jednu ulohu:
+        util.task.TaskStatusResolver.for_task(task, user).status(task)
+    """
+
+    def __init__(self, user: Optional[model.User], year_id: int,
+                 waves: Optional[Dict[int, model.Wave]] = None) -> None:
+        self.user = user
+        self.year_id = year_id
+        self.adeadline: FrozenSet[int] = after_deadline()
+        util.prerequisite.refresh()
+
+        if user is not None and user.id is not None:
+            self.fsubmitted: Dict[int, int] = fully_submitted(user.id, year_id)
+            self.corrected: Set[int] = set(corrected(user.id, year_id))
+            self.acfull: Set[int] = set(autocorrected_full(user.id, year_id))
+        else:
+            self.fsubmitted = {}
+            self.corrected = set()
+            self.acfull = set()
+
+        if waves is None:
+            waves = {
+                wave.id: wave for wave in
+                session.query(model.Wave).filter(model.Wave.year == year_id)
+            }
+        self.waves: Dict[int, model.Wave] = waves
+
+    @classmethod
+    def for_task(cls, task: model.Task, user: Optional[model.User])\
+            -> 'TaskStatusResolver':
+        """Resolver pro zjisteni stavu jedine ulohy (nenacita vsechny vlny
+        rocniku, jen vlnu ulohy)."""
+        wave = task.wave_
+        return cls(user, wave.year, {wave.id: wave})
+
+    def wave(self, task: model.Task) -> model.Wave:
+        if task.wave not in self.waves:
+            self.waves[task.wave] = session.query(model.Wave).get(task.wave)
+        return self.waves[task.wave]
+
+    def status(self, task: model.Task,
+               wave: Optional[model.Wave] = None) -> str:
+        return status(
+            task, self.user, self.adeadline, self.fsubmitted,
+            wave if wave is not None else self.wave(task),
+            task.id in self.corrected, task.id in self.acfull
+        )
+
+    def statuses(self, tasks: List[model.Task]) -> Dict[int, str]:
+        """Vraci { task_id : TaskStatus } pro vsechny ulohy 'tasks'"""
+        return {task.id: self.status(task) for task in tasks}
+
+
 def solution_public(status: str, task: model.Task, user: model.User) -> bool:
     return (((task.time_deadline) and
              (status == TaskStatus.DONE or
@@ -336,6 +504,12 @@ def solution_public(status: str, task: model.Task, user: model.User) -> bool:
             user.role in ('org', 'admin', 'tester'))
 
 
+def year_of_task(task_id: int) -> Optional[int]:
+    return session.query(model.Wave.year).\
+        join(model.Task, model.Task.wave == model.Wave.id).\
+        filter(model.Task.id == task_id).scalar()
+
+
 def time_published(task_id: int) -> datetime.datetime:
     return session.query(model.Wave.time_published).\
         join(model.Task, model.Task.wave == model.Wave.id).\
@@ -362,21 +536,29 @@ class TaskDict(TypedDict):
 
 def to_json(task: model.Task, prereq_obj,
             user: Optional[model.User] = None,
-            adeadline: Optional[Set[int]] = None,
+            adeadline: Optional[AbstractSet[int]] = None,
             fsubmitted: Optional[Dict[int, int]] = None,
             wave: Optional[model.Wave] = None,
             corr: Optional[bool] = None,
             acfull: Optional[bool] = None,
-            task_max_points: Optional[float] = None) -> TaskDict:
+            task_max_points: Optional[float] = None,
+            resolver: Optional[TaskStatusResolver] = None) -> TaskDict:
+    """Pokud je vyplnen 'resolver', stav ulohy se zjisti z nej a argumenty
+    adeadline, fsubmitted, corr a acfull se ignoruji."""
 
     if task_max_points is None:
         task_max_points = max_points(task.id)
-    tstatus = status(task, user, adeadline, fsubmitted, wave, corr, acfull)
+    if resolver is not None:
+        tstatus = resolver.status(task, wave)
+    else:
+        tstatus = status(task, user, adeadline, fsubmitted, wave, corr,
+                         acfull)
     pict_base = (task.picture_base if task.picture_base is not None
                  else "/taskContent/" + str(task.id) + "/icon/")
 
     if wave is None:
-        wave = session.query(model.Wave).get(task.wave)
+        wave = (resolver.wave(task) if resolver is not None
+                else session.query(model.Wave).get(task.wave))
 
     return {
         'id': task.id,
@@ -1,6 +1,11 @@
 import os
+from bisect import bisect_right
+from threading import Lock
+from typing import Dict, List, NamedTuple
+
 from sqlalchemy import func, or_
 
+import db
 from db import session
 import model
 import util
@@ -29,13 +34,9 @@ def active_years(user_id):
     if user_id is None:
         return []
 
-    a = session.query(model.Year.id). \
-        join(model.Wave, model.Wave.year == model.Year.id).\
-        join(model.Task, model.Task.wave == model.Wave.id).\
-        join(model.Module, model.Module.task == model.Task.id).\
-        join(model.Evaluation, model.Evaluation.module == model.Module.id).\
-        filter(model.Evaluation.user == user_id).\
-        group_by(model.Year).all()
+    a = session.query(model.BestScore.year). \
+        filter(model.BestScore.user == user_id).\
+        group_by(model.BestScore.year).all()
     return a
 
 
@@ -88,16 +89,15 @@ def any_task_submitted(user_id, year_id):
 def sum_points(user_id, year_id) -> (int, bool):
     """Returns (points, cheating)."""
     evals = session.query(
-        func.max(model.Evaluation.points).label('points'),
-        func.max(model.Evaluation.cheat).label('cheat'),
+        model.BestScore.points.label('points'),
+        model.BestScore.cheat.label('cheat'),
     ).\
-        filter(model.Evaluation.user == user_id).\
-        join(model.Module, model.Evaluation.module == model.Module.id).\
+        filter(model.BestScore.user == user_id,
+               model.BestScore.year == year_id).\
+        join(model.Module, model.BestScore.module == model.Module.id).\
         join(model.Task, model.Task.id == model.Module.task).\
         filter(model.Task.evaluation_public).\
-        join(model.Wave, model.Wave.id == model.Task.wave).\
-        filter(model.Wave.year == year_id).\
-        group_by(model.Evaluation.module).all()
+        all()
 
     return (
         sum([points for points, _ in evals if points is not None]),
@@ -105,38 +105,78 @@ def sum_points(user_id, year_id) -> (int, bool):
     )
 
 
-def percentile(user_id, year_id):
+class PercentileIndex(NamedTuple):
+    """Serazene body vsech uzivatelu s kladnym poctem bodu v rocniku."""
+    version: str
+    points: Dict[int, float]  # {user_id: points}
+    order: List[float]  # body serazene vzestupne
+
+
+# Cache indexu per rocnik v ramci workeru, platnost je svazana s verzi bodu
+# rocniku (util.cache.scores_version), ktera se meni s kazdou zmenou bodu.
+_percentile_indexes: Dict[int, PercentileIndex] = {}
+_percentile_indexes_lock = Lock()
+
+
+def percentile_index(year_id) -> PercentileIndex:
+    version = util.cache.scores_version(year_id)
+    index = _percentile_indexes.get(year_id)
+    if index is not None and index.version == version:
+        return index
+
+    with db.on_primary():
+        all_points = user_points(year_id)
     upoints = {
         userid: points
-        for userid, points in user_points(year_id).items()
+        for userid, points in all_points.items()
         if points > 0
     }
-    if user_id not in upoints:
+    index = PercentileIndex(version, upoints, sorted(upoints.values()))
+    with _percentile_indexes_lock:
+        _percentile_indexes[year_id] = index
+    return index
+
+
+def invalidate_percentiles(year_id=None) -> None:
+    """Zahodi index rocniku v tomto workeru (ostatni workery zneplatni
+    util.cache.bump_scores_version)."""
+    with _percentile_indexes_lock:
+        if year_id is None:
+            _percentile_indexes.clear()
+        else:
+            _percentile_indexes.pop(year_id, None)
+
+
+def _percentile(index: PercentileIndex, user_id) -> int:
+    if user_id not in index.points:
         return 0
 
-    points_order = sorted(list(upoints.values()), reverse=True)
+    # Poradi = pocet uzivatelu s vice body nez uzivatel
+    higher = len(index.order) - bisect_right(index.order,
+                                             index.points[user_id])
+    return round((1 - (higher / len(index.order))) * 100)
 
-    rank = 0
-    for points in points_order:
-        if points == upoints[user_id]:
-            return round((1 - (rank / len(points_order))) * 100)
-        rank += 1
 
-    return 0
+def percentile(user_id, year_id):
+    return _percentile(percentile_index(year_id), user_id)
+
+
+def percentiles(user_ids, year_id) -> Dict[int, int]:
+    """Vraci {user_id: percentil} pro vsechny 'user_ids' v rocniku."""
+    index = percentile_index(year_id)
+    return {user_id: _percentile(index, user_id) for user_id in user_ids}
 
 
 def points_per_module_subq(year_id):
-    return session.query(model.User.id.label('user'),
-                         model.Evaluation.module.label('module'),
-                         func.max(model.Evaluation.points).label('points'),
-                         func.max(model.Evaluation.cheat).label('cheat')).\
-        join(model.Evaluation, model.Evaluation.user == model.User.id).\
-        join(model.Module, model.Evaluation.module == model.Module.id).\
+    return session.query(model.BestScore.user.label('user'),
+                         model.BestScore.module.label('module'),
+                         model.BestScore.points.label('points'),
+                         model.BestScore.cheat.label('cheat')).\
+        join(model.Module, model.BestScore.module == model.Module.id).\
         join(model.Task, model.Task.id == model.Module.task).\
         filter(model.Task.evaluation_public).\
-        join(model.Wave, model.Wave.id == model.Task.wave).\
-        filter(model.Wave.year == year_id).\
-        group_by(model.User.id, model.Evaluation.module).subquery()
+        filter(model.BestScore.year == year_id).\
+        subquery()
 
 
 def user_points(year_id):
@@ -1,4 +1,6 @@
-from typing import Optional, Tuple, TypedDict
+from threading import Lock
+from time import time
+from typing import Dict, NamedTuple, Optional, Tuple, TypedDict
 
 from db import session
 import model
@@ -34,3 +36,67 @@ def to_json(year: model.Year,
 
 def year_end(year: model.Year) -> int:
     return int(year.year.replace(" ", "").split("/")[0]) + 1
+
+
+class YearInfo(NamedTuple):
+    """Odpojena kopie model.Year pro req.context['year_obj']"""
+    id: int
+    year: str
+    sealed: bool
+    point_pad: float
+
+
+class YearRegistry:
+    """
+    Rocniky v pameti workeru (tabulka 'years' je mala a meni se zridka).
+    Nacitaji se vsechny jednim dotazem, znovu po 'ttl' sekundach nebo po
+    zmene verze util.cache 'years' (invalidate() z endpoint/year.py).
+    """
+
+    VERSION_KEY = 'years'
+
+    def __init__(self, ttl: float = 60) -> None:
+        self.ttl = ttl
+        self.__years: Dict[int, YearInfo] = {}
+        self.__current: Optional[YearInfo] = None
+        self.__version: Optional[str] = None
+        self.__loaded = 0.0
+        self.__lock = Lock()
+
+    def __refresh(self) -> None:
+        ver = util.cache.version(self.VERSION_KEY)
+        if ver == self.__version and time() - self.__loaded < self.ttl:
+            return
+
+        years = {
+            year.id: YearInfo(id=year.id, year=year.year, sealed=year.sealed,
+                              point_pad=year.point_pad)
+            for year in session.query(model.Year).all()
+        }
+        self.__years = years
+        self.__current = years[max(years)] if years else None
+        self.__version = ver
+        self.__loaded = time()
+
+    def get(self, year_id) -> Optional[YearInfo]:
+        try:
+            year_id = int(year_id)
+        except (TypeError, ValueError):
+            return None
+        with self.__lock:
+            self.__refresh()
+            return self.__years.get(year_id)
+
+    def current(self) -> Optional[YearInfo]:
+        """Vraci aktualni (posledni) rocnik"""
+        with self.__lock:
+            self.__refresh()
+            return self.__current
+
+    def invalidate(self) -> None:
+        with self.__lock:
+            self.__version = None
+        util.cache.bump(self.VERSION_KEY)
+
+
+years = YearRegistry()
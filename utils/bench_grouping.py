@@ -0,0 +1,98 @@
+#!/usr/bin/env/python3
+
+"""
+Micro-benchmark of scoreboard row assembly (endpoint/user.py:Users).
+Compares per-user filtering of the whole result list (original approach,
+O(users * rows)) with single-pass grouping from util/grouping.py
+(O(users + rows)) for increasing number of users.
+Does not need database nor backend config.
+
+Usage: python3 utils/bench_grouping.py [max_users]
+"""
+
+import importlib.util
+import random
+import sys
+from collections import namedtuple
+from pathlib import Path
+from timeit import timeit
+from typing import Callable, Dict, List
+
+# util/__init__.py imports the whole backend (incl. database), load just the
+# grouping module
+_spec = importlib.util.spec_from_file_location(
+    'grouping', Path(__file__).resolve().parent.parent / 'util' / 'grouping.py'
+)
+grouping = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(grouping)
+
+Achievement = namedtuple('Achievement', ['user_id', 'a_id'])
+Season = namedtuple('Season', ['year_id', 'user_id'])
+
+ACHIEVEMENTS_PER_USER = 4
+SEASONS_PER_USER = 2
+
+
+def make_rows(users: int):
+    achievements = [
+        Achievement(user_id=u, a_id=random.randint(1, 100))
+        for u in range(users) for _ in range(ACHIEVEMENTS_PER_USER)
+    ]
+    seasons = [
+        Season(year_id=y, user_id=u)
+        for u in range(users) for y in range(SEASONS_PER_USER)
+    ]
+    random.shuffle(achievements)
+    random.shuffle(seasons)
+    return achievements, seasons
+
+
+def assemble_filter(users: int, achievements, seasons) -> List[Dict]:
+    return [
+        {
+            'achs': [item.a_id for item in achievements if item.user_id == u],
+            'seasons': [item.year_id for item in seasons if item.user_id == u],
+        }
+        for u in range(users)
+    ]
+
+
+def assemble_grouped(users: int, achievements, seasons) -> List[Dict]:
+    achs_by_user = grouping.group_by(achievements, lambda item: item.user_id,
+                                     lambda item: item.a_id)
+    seasons_by_user = grouping.group_by(seasons, lambda item: item.user_id,
+                                        lambda item: item.year_id)
+    return [
+        {
+            'achs': achs_by_user.get(u, []),
+            'seasons': seasons_by_user.get(u, []),
+        }
+        for u in range(users)
+    ]
+
+
+def measure(fn: Callable, users: int, achievements, seasons) -> float:
+    runs = 3
+    return timeit(lambda: fn(users, achievements, seasons), number=runs) / runs
+
+
+def main() -> None:
+    max_users = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    random.seed(42)
+
+    print(f"{'users':>8} {'filter [ms]':>12} {'grouped [ms]':>13} {'speedup':>8}")
+    users = 250
+    while users <= max_users:
+        achievements, seasons = make_rows(users)
+        assert assemble_filter(users, achievements, seasons) == \
+            assemble_grouped(users, achievements, seasons)
+
+        t_filter = measure(assemble_filter, users, achievements, seasons)
+        t_grouped = measure(assemble_grouped, users, achievements, seasons)
+        print(f"{users:>8} {t_filter * 1000:>12.1f} {t_grouped * 1000:>13.2f} "
+              f"{t_filter / t_grouped:>7.0f}x")
+        users *= 2
+
+
+if __name__ == '__main__':
+    main()
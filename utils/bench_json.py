@@ -0,0 +1,92 @@
+#!/usr/bin/env/python3
+
+"""
+Benchmark serializace odpovedi (util/serialization.py) na velke vysledkovce
+(tvar odpovedi /users): citelny JSON (indent=4, sort_keys) vs kompaktni
+json vs kompaktni orjson (pokud je nainstalovan).
+Nepotrebuje databazi ani konfiguraci backendu.
+
+Usage: python3 utils/bench_json.py [users]
+"""
+
+import importlib.util
+import json
+import random
+import sys
+from pathlib import Path
+from timeit import timeit
+from typing import Callable, Dict, List
+
+# util/__init__.py importuje cely backend (vcetne databaze), nacteme jen
+# modul serializace
+_spec = importlib.util.spec_from_file_location(
+    'serialization',
+    Path(__file__).resolve().parent.parent / 'util' / 'serialization.py'
+)
+serialization = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(serialization)
+
+
+def make_scoreboard(users: int) -> Dict[str, List[Dict]]:
+    return {'users': [
+        {
+            'id': i,
+            'first_name': random.choice(['Jan', 'Petra', 'Tomáš', 'Eliška']),
+            'last_name': random.choice(['Novák', 'Svobodová', 'Dvořák']),
+            'nick_name': f'nick{i}',
+            'profile_picture': f'/images/profile/{i}',
+            'gender': random.choice(['male', 'female']),
+            'role': 'participant',
+            'score': round(random.uniform(0, 150), 1),
+            'tasks_num': random.randint(0, 30),
+            'achievements': random.sample(range(100), random.randint(0, 8)),
+            'enabled': True,
+            'addr_country': 'cz',
+            'school_name': 'Gymnázium, Brno, třída Kapitána Jaroše 14',
+            'seasons': random.sample(range(1, 12), random.randint(1, 4)),
+            'successful': random.random() < 0.3,
+            'cheat': False,
+        }
+        for i in range(users)
+    ]}
+
+
+def measure(fn: Callable[[], str]) -> float:
+    runs = 5
+    return timeit(fn, number=runs) / runs
+
+
+def main() -> None:
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    random.seed(42)
+    payload = make_scoreboard(users)
+
+    variants = {
+        'pretty (json)':
+            lambda: serialization.encode_json(payload, pretty=True),
+        'compact (json)':
+            lambda: json.dumps(payload, ensure_ascii=False,
+                               separators=(',', ':')),
+    }
+    if serialization.orjson is not None:
+        variants['compact (orjson)'] = \
+            lambda: serialization.encode_json(payload)
+    else:
+        print("orjson is not installed, skipping orjson backend")
+
+    baseline = None
+    print(f"{users} users")
+    print(f"{'variant':>18} {'time [ms]':>10} {'size [kB]':>10} {'speedup':>8}")
+    for name, fn in variants.items():
+        body = fn()
+        assert json.loads(body) == payload
+        t = measure(fn)
+        if baseline is None:
+            baseline = t
+        size = len(body.encode('utf-8')) / 1024
+        print(f"{name:>18} {t * 1000:>10.1f} {size:>10.0f} "
+              f"{baseline / t:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
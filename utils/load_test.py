@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+"""
+Jednoduchy zatezovy test backendu: posila GET pozadavky z 'concurrency'
+vlaken a vypise propustnost a latence.
+
+Porovnani sync a gthread workeru (stejny pocet procesu):
+    gunicorn -c gunicorn_cfg.py --worker-class sync --threads 1 app:api
+    python3 utils/load_test.py http://127.0.0.1:3030/tasks/1 -c 32 -n 2000
+
+    gunicorn -c gunicorn_cfg.py --worker-class gthread --threads 8 app:api
+    python3 utils/load_test.py http://127.0.0.1:3030/tasks/1 -c 32 -n 2000
+
+Pozor: sync worker s threads > 1 (gunicorn_cfg.py) gunicorn potichu
+nahradi gthread workerem, proto '--threads 1'. Merit endpoint, ktery
+dela dotazy do databaze pri kazdem pozadavku (/tasks/1), /tasks se
+obsluhuje z cache. Rozdil je videt jen s latenci databaze (sitova MySQL),
+ne s lokalnim sqlite souborem.
+
+Pro prihlaseneho uzivatele pridejte -H 'Authorization: Bearer <token>'.
+"""
+
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from urllib import request
+from urllib.error import HTTPError, URLError
+
+
+def fetch(url: str, headers: Dict[str, str], timeout: float)\
+        -> Tuple[float, Optional[int]]:
+    """Vraci (latence [s], HTTP status nebo None pri chybe spojeni)"""
+    start = time.perf_counter()
+    try:
+        with request.urlopen(request.Request(url, headers=headers),
+                             timeout=timeout) as resp:
+            resp.read()
+            status = resp.status
+    except HTTPError as e:
+        status = e.code
+    except (URLError, OSError):
+        status = None
+    return time.perf_counter() - start, status
+
+
+def percentile(values: List[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Simple HTTP load test")
+    parser.add_argument('url')
+    parser.add_argument('-c', '--concurrency', type=int, default=16)
+    parser.add_argument('-n', '--requests', type=int, default=1000)
+    parser.add_argument('-H', '--header', action='append', default=[],
+                        help="extra header 'Name: value' (repeatable)")
+    parser.add_argument('--timeout', type=float, default=60)
+    args = parser.parse_args()
+
+    headers = dict(
+        (name.strip(), value.strip())
+        for name, value in (h.split(':', 1) for h in args.header)
+    )
+
+    # Zahrivaci pozadavek (naplneni cache, navazani spojeni s DB)
+    fetch(args.url, headers, args.timeout)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(
+            lambda _: fetch(args.url, headers, args.timeout),
+            range(args.requests)
+        ))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in results]
+    ok = sum(1 for _, status in results if status is not None and
+             200 <= status < 400)
+    failed = len(results) - ok
+
+    print(f"requests:    {len(results)} ({failed} failed), "
+          f"concurrency {args.concurrency}")
+    print(f"duration:    {elapsed:.2f} s")
+    print(f"throughput:  {len(results) / elapsed:.1f} req/s")
+    print(f"latency:     mean {statistics.mean(latencies) * 1000:.1f} ms, "
+          f"p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+          f"p95 {percentile(latencies, 95) * 1000:.1f} ms, "
+          f"p99 {percentile(latencies, 99) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+"""
+Samostatny worker opravovani odevzdaneho kodu. Zabira ulohy z tabulky
+evaluation_jobs (util/evaluation_job.py:claim), opravuje je v sandboxu
+tohoto stroje a vysledek zapisuje zpet do databaze.
+Pouziti (z korenoveho adresare backendu, se stejnym config.py a adresarem
+data/ jako web):
+    python -m worker [--threads N]
+
+Workery lze spustit na vice strojich, kazdy stroj spousti nejvyse
+MAX_CONCURRENT_EXEC sandboxu. Na webu nastavit EVAL_REMOTE_WORKERS = True
+(ulohy pak zpracovavaji jen workery) a pripadne ASYNC_EVALUATION = True.
+SIGTERM/SIGINT: worker dokonci rozpracovane ulohy a skonci.
+"""
+
+import argparse
+import signal
+import threading
+import traceback
+
+from sqlalchemy.exc import SQLAlchemyError
+
+import config
+import util
+from db import session
+from util.logger import get_log
+
+POLL_INTERVAL = getattr(config, 'EVAL_WORKER_POLL_INTERVAL', 1.0)
+
+
+def work(stop: threading.Event) -> None:
+    while not stop.is_set():
+        try:
+            claim = util.evaluation_job.claim()
+            if claim is None:
+                stop.wait(POLL_INTERVAL)
+                continue
+            get_log().info(f"Evaluating job {claim.evaluation_id}")
+            util.evaluation_job.run(claim)
+        except SQLAlchemyError:
+            # Uloha se po vyprseni leasu zpracuje znovu
+            session.rollback()
+            get_log().error(f"Worker database error:\n"
+                            f"{traceback.format_exc()}")
+            stop.wait(POLL_INTERVAL)
+        finally:
+            session.remove()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Evaluate submitted code from the evaluation_jobs table"
+    )
+    parser.add_argument('--threads', type=int,
+                        default=util.programming.MAX_CONCURRENT_EXEC,
+                        help="jobs evaluated at once (default: "
+                             "MAX_CONCURRENT_EXEC)")
+    args = parser.parse_args()
+
+    util.programming.prepare_exec_path()
+
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    signal.signal(signal.SIGINT, lambda *_: stop.set())
+
+    threads = [
+        threading.Thread(target=work, args=(stop,), name=f'worker-{i}')
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    print(f"Worker {util.evaluation_job.worker_id()} started "
+          f"({args.threads} threads)")
+
+    # join s timeoutem, aby hlavni vlakno obslouzilo signaly
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(1)
+
+
+if __name__ == '__main__':
+    main()